@@ -0,0 +1,11 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "MeetPlan.settings")
+
+app = Celery("MeetPlan")
+
+# all celery settings are prefixed with CELERY_ in the django settings
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
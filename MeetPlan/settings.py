@@ -9,9 +9,12 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -39,6 +42,8 @@ INSTALLED_APPS = [
     "django_filters",
     "graphql_jwt.refresh_token",
     "guardian",
+    "django_celery_results",
+    "django_celery_beat",
     "apps.user",
     "apps.pku_auth",
     "apps.meet_plan",
@@ -173,11 +178,37 @@ GRAPHENE = {
 if DEBUG:
     GRAPHENE["MIDDLEWARE"].append("graphene_django.debug.DjangoDebugMiddleware")
 
+# Celery
+# https://docs.celeryproject.org/en/stable/django/first-steps-with-django.html
+# set CELERY_BROKER_URL to a shared broker (e.g. redis://) and run workers in production, without it
+# the tasks run in the web process after the commit; CELERY_TASK_ALWAYS_EAGER=true/false overrides that
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "memory://")
+CELERY_TASK_ALWAYS_EAGER = os.environ.get(
+    "CELERY_TASK_ALWAYS_EAGER", str(CELERY_BROKER_URL == "memory://")
+).lower() in ("1", "true", "yes")
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_RESULT_BACKEND = "django-db"
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    # slots freed without a signal, e.g. by update()
+    "assign-waitlists": {
+        "task": "apps.meet_plan.tasks.assign_waitlists",
+        "schedule": 60.0,
+    },
+    # corrects the counts of concurrent changes
+    "rebuild-meet-plan-stats": {
+        "task": "apps.meet_plan.tasks.rebuild_meet_plan_stats",
+        "schedule": crontab(hour=4, minute=0),
+    },
+}
+
 AUTH_USER_MODEL = "user.User"
 
 AUTHENTICATION_BACKENDS = [
     "apps.pku_auth.backends.OpenIDClientBackend",
     "graphql_jwt.backends.JSONWebTokenBackend",
+    "apps.meet_plan.backends.MeetPlanOwnerBackend",
     "guardian.backends.ObjectPermissionBackend",
     "django.contrib.auth.backends.ModelBackend",
 ]
@@ -199,6 +230,44 @@ GRAPHQL_JWT = {
 
 GRAPHENE_DJANGO_PLUS = {"MUTATIONS_INCLUDE_REVERSE_RELATIONS": False}
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Cached connection counts and the term date are invalidated through this cache,
+# use a backend shared by all workers (e.g. memcached) when running several processes.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # queries registered by the clients through automatic persisted queries, see apps.pku_auth.views
+    "persisted_queries": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "persisted-queries",
+        "TIMEOUT": 7 * 24 * 3600,
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+PERSISTED_QUERIES_CACHE = "persisted_queries"
+# parsed and validated GraphQL documents kept by each process, see apps.pku_auth.documents
+GRAPHQL_DOCUMENT_CACHE_SIZE = 500
+
+# operations which can return more objects or are nested deeper are rejected, see apps.pku_auth.cost
+GRAPHQL_MAX_QUERY_COST = 50000
+GRAPHQL_MAX_QUERY_DEPTH = 10
+# objects a list field (e.g. termDates) is assumed to return in the cost, as it has no page size
+GRAPHQL_LIST_SIZE = 100
+
+# root query fields whose responses to anonymous users are cached, with the models they are read from;
+# the current term date also depends on the day, so keep the timeout short
+ANONYMOUS_RESPONSE_CACHE_FIELDS = {
+    "openidClient": ["pku_auth.OpenIDClient"],
+    "termDate": ["meet_plan.TermDate"],
+    "departments": ["user.Department"],
+}
+ANONYMOUS_RESPONSE_CACHE_TIMEOUT = 60 * 5
+
+# seconds a totalCount of a connection with count_strategy "cached" is kept at most
+CONNECTION_COUNT_CACHE_TIMEOUT = 60 * 5
+
 # Django Guardian
 # https://django-guardian.readthedocs.io/en/stable/configuration.html#anonymous-user-name
 ANONYMOUS_USER_NAME = "0000000000"
@@ -18,7 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+
+from apps.pku_auth.views import GraphQLView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -1,15 +1,17 @@
+import csv
+
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
-from django.db import models
-from django.db.models import Case, When, Value
-from django.urls import reverse
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.urls import path, reverse
 from django.utils import timezone
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from guardian.admin import GuardedModelAdmin
 
-from apps.meet_plan.models import MeetPlan, TermDate
+from apps.meet_plan.models import MeetPlan, TermDate, WaitlistEntry
 
 
 class AvailableFilter(SimpleListFilter):
@@ -25,18 +27,19 @@ class AvailableFilter(SimpleListFilter):
     def queryset(self, request, queryset):
         now = timezone.now()
 
-        queryset = queryset.annotate(
-            available=Case(
-                When(start_time__gt=now, student__isnull=True, then=Value(True)),
-                output_field=models.BooleanField(),
-                default=Value(False),
-            ),
-        )
+        queryset = queryset.annotate_available(now)
         if self.value() == "yes":
-            return queryset.filter(available=True)
+            return queryset.filter_available(True, now)
 
         if self.value() == "no":
-            return queryset.filter(available=False)
+            return queryset.filter_available(False, now)
+
+
+class Echo:
+    """A file-like object which returns what is written, so that csv.writer produces strings to stream."""
+
+    def write(self, value):
+        return value
 
 
 @admin.register(MeetPlan)
@@ -54,6 +57,11 @@ class MeetPlanAdmin(GuardedModelAdmin):
     list_filter = [AvailableFilter, "complete"]
     search_fields = ["teacher__name", "student__name"]
     list_select_related = ["teacher", "student"]
+    actions = ["export_csv"]
+    change_list_template = "admin/meet_plan/meetplan/change_list.html"
+
+    # rows fetched per query when exporting
+    export_chunk_size = 2000
 
     @admin.display(description=_("available"), boolean=True)
     def available(self, obj):
@@ -79,8 +87,96 @@ class MeetPlanAdmin(GuardedModelAdmin):
             link = reverse("admin:user_user_change", args=[obj.student_id])
             return mark_safe(f'<a href="{link}">{escape(obj.student.pku_id)}</a>')
 
+    def get_urls(self):
+        urls = [
+            path(
+                "export/",
+                self.admin_site.admin_view(self.export_view),
+                name=f"{self.model._meta.app_label}_{self.model._meta.model_name}_export",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def export_view(self, request):
+        """The plans of the change list with its filters and search, as CSV."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        changelist = self.get_changelist_instance(request)
+        return self.export_csv(request, changelist.get_queryset(request))
+
+    @admin.action(description=_("Export selected meet plans as CSV"), permissions=["view"])
+    def export_csv(self, request, queryset):
+        filename = f"meet-plans-{timezone.localdate().isoformat()}.csv"
+        response = StreamingHttpResponse(self.stream_csv(queryset), content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    def stream_csv(self, queryset):
+        """
+        Yield the CSV lines of the plans, fetched ``export_chunk_size`` rows at a time,
+        so that the memory does not grow with the number of exported plans.
+        """
+        writer = csv.writer(Echo())
+        # byte order mark, so that spreadsheet programs read the names as utf-8
+        yield "\ufeff"
+        yield writer.writerow(
+            [
+                "id",
+                _("Teacher Name"),
+                _("Teacher PKU ID"),
+                _("place"),
+                _("start time"),
+                _("duration"),
+                _("available"),
+                _("Student Name"),
+                _("Student PKU ID"),
+                _("teacher message"),
+                _("student message"),
+                _("status"),
+            ]
+        )
+        now = timezone.now()
+        queryset = queryset.select_related("teacher", "student").only(
+            "teacher__name",
+            "teacher__pku_id",
+            "place",
+            "start_time",
+            "duration",
+            "student__name",
+            "student__pku_id",
+            "t_message",
+            "s_message",
+            "complete",
+        )
+        for obj in queryset.iterator(chunk_size=self.export_chunk_size):
+            yield writer.writerow(
+                [
+                    obj.id,
+                    obj.teacher.name,
+                    obj.teacher.pku_id,
+                    obj.place,
+                    timezone.localtime(obj.start_time).isoformat(),
+                    obj.get_duration_display(),
+                    obj.start_time > now and obj.student_id is None,
+                    obj.student.name if obj.student_id else "",
+                    obj.student.pku_id if obj.student_id else "",
+                    obj.t_message,
+                    obj.s_message,
+                    obj.complete,
+                ]
+            )
+
 
 @admin.register(TermDate)
 class TermDate(admin.ModelAdmin):
     list_display = ["start_date"]
     ordering = ["-id"]
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ["id", "teacher", "student", "created", "meet_plan"]
+    list_filter = [("meet_plan", admin.EmptyFieldListFilter)]
+    search_fields = ["teacher__name", "student__name"]
+    list_select_related = ["teacher", "student", "meet_plan"]
+    raw_id_fields = ["teacher", "student", "meet_plan"]
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -6,3 +7,22 @@ class MeetPlanConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.meet_plan"
     verbose_name = _("Meet plan")
+
+    def ready(self):
+        from apps.meet_plan.models import MeetPlan, TermDate
+        from apps.meet_plan.signals import (
+            meet_plan_saved_callback,
+            meet_plan_stats_post_delete,
+            meet_plan_stats_post_save,
+            meet_plan_stats_pre_save,
+            term_date_changed_callback,
+        )
+
+        post_save.connect(receiver=term_date_changed_callback, sender=TermDate, dispatch_uid="term_date_save")
+        post_delete.connect(receiver=term_date_changed_callback, sender=TermDate, dispatch_uid="term_date_delete")
+        post_save.connect(receiver=meet_plan_saved_callback, sender=MeetPlan, dispatch_uid="meet_plan_save")
+        pre_save.connect(receiver=meet_plan_stats_pre_save, sender=MeetPlan, dispatch_uid="meet_plan_stats_pre_save")
+        post_save.connect(receiver=meet_plan_stats_post_save, sender=MeetPlan, dispatch_uid="meet_plan_stats_save")
+        post_delete.connect(
+            receiver=meet_plan_stats_post_delete, sender=MeetPlan, dispatch_uid="meet_plan_stats_delete"
+        )
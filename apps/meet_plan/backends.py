@@ -0,0 +1,26 @@
+from django.core.exceptions import PermissionDenied
+
+from apps.meet_plan.models import MeetPlan
+
+
+class MeetPlanOwnerBackend:
+    """
+    Answers the object permissions of meet plans from their teacher, without any query.
+
+    The teacher of a plan may change and delete it, nobody else has these object permissions:
+    other users are refused here so that the per-object rows of guardian are not looked up.
+    Admins are handled by the mutations themselves.
+    """
+
+    owner_perms = {"meet_plan.change_meetplan", "meet_plan.delete_meetplan"}
+
+    def authenticate(self, request, **kwargs):
+        return None
+
+    def has_perm(self, user_obj, perm, obj=None):
+        if not isinstance(obj, MeetPlan) or perm not in self.owner_perms:
+            return False
+        if user_obj.is_active and obj.teacher_id == user_obj.id:
+            return True
+        # stop the other backends, see django.contrib.auth.models._user_has_perm
+        raise PermissionDenied
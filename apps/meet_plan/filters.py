@@ -0,0 +1,50 @@
+from django_filters import BooleanFilter, FilterSet
+from graphene_django.filter import GlobalIDFilter
+from graphql_relay import from_global_id
+
+from apps.meet_plan.models import MeetPlan, TermDate, get_start_date
+from apps.meet_plan.utils import get_request_now
+from apps.user.filters import PkuIdFilter
+
+
+class MeetPlanFilter(FilterSet):
+    """
+    Only the meet plans of the current term are returned,
+    unless an other ``term`` or ``all_terms`` is asked for.
+    """
+
+    available = BooleanFilter(method="filter_available")
+    term = GlobalIDFilter(method="filter_term")
+    all_terms = BooleanFilter(method="filter_all_terms")
+    student__pku_id__contains = PkuIdFilter(field_name="student__pku_id", lookup_expr="contains")
+    student__pku_id__startswith = PkuIdFilter(field_name="student__pku_id", lookup_expr="startswith")
+
+    class Meta:
+        model = MeetPlan
+        fields = {
+            "teacher__id": ["exact", "in"],
+            "start_time": ["lt", "gt"],
+            "duration": ["exact", "in", "gte", "lte"],
+            # TODO: make student__pku_id filter only for admin user to protect privacy
+            "student__pku_id": ["exact"],
+            "complete": ["exact"],
+        }
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not self.form.cleaned_data.get("term") and not self.form.cleaned_data.get("all_terms"):
+            queryset = queryset.filter_term(get_start_date())
+        return queryset
+
+    def filter_available(self, queryset, name, value):
+        return queryset.filter_available(value, get_request_now(self.request))
+
+    def filter_term(self, queryset, name, value):
+        _, pk = from_global_id(value)
+        term_date = TermDate.objects.filter(pk=pk).first()
+        if term_date is None:
+            return queryset.none()
+        return queryset.filter_term(term_date.start_date, term_date.get_end_date())
+
+    def filter_all_terms(self, queryset, name, value):
+        return queryset
@@ -0,0 +1,109 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.meet_plan.models import MeetPlan, get_start_date
+from apps.user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the meet plan filter queries with and without the MeetPlan indexes. "
+        "Sample rows are created in a transaction which is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000, help="Number of sample meet plans.")
+        parser.add_argument("--teachers", type=int, default=200, help="Number of sample teachers.")
+        parser.add_argument("--students", type=int, default=5000, help="Number of sample students.")
+        parser.add_argument("--repeat", type=int, default=20, help="Times each query is executed.")
+
+    def handle(self, *args, **options):
+        if not connection.features.can_rollback_ddl:
+            raise CommandError("This benchmark needs a database which can rollback DDL, e.g. sqlite or postgresql.")
+
+        with transaction.atomic():
+            teacher, student = self.populate(options["rows"], options["teachers"], options["students"])
+            queries = self.get_queries(teacher, student)
+
+            self.set_indexes(enabled=False)
+            before = self.run_queries(queries, options["repeat"])
+            self.set_indexes(enabled=True)
+            after = self.run_queries(queries, options["repeat"])
+
+            transaction.set_rollback(True)
+
+        for name in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, result in (("before", before[name]), ("after", after[name])):
+                self.stdout.write(f"  {label}: {result['latency'] * 1000:.3f} ms")
+                for line in result["plan"].splitlines():
+                    self.stdout.write(f"    {line}")
+        self.stdout.write(self.style.SUCCESS("Benchmark finished, sample data has been rolled back."))
+
+    @staticmethod
+    def populate(rows, teachers, students):
+        teachers = User.objects.bulk_create(
+            [User(pku_id=f"9{i:09d}", name=f"teacher{i}", is_teacher=True) for i in range(teachers)]
+        )
+        students = User.objects.bulk_create([User(pku_id=f"8{i:09d}", name=f"student{i}") for i in range(students)])
+        # bulk_create does not return primary keys on every backend
+        teachers = list(User.objects.filter(pku_id__range=(teachers[0].pku_id, teachers[-1].pku_id)))
+        students = list(User.objects.filter(pku_id__range=(students[0].pku_id, students[-1].pku_id)))
+
+        now = timezone.now()
+        plans = []
+        for i in range(rows):
+            start_time = now + timedelta(minutes=30 * random.randint(-17520, 17520))
+            student = random.choice(students) if random.random() < 0.6 else None
+            plans.append(
+                MeetPlan(
+                    teacher=random.choice(teachers),
+                    place="office",
+                    start_time=start_time,
+                    student=student,
+                    complete=student is not None and start_time < now,
+                )
+            )
+        MeetPlan.objects.bulk_create(plans, batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        return teachers[0], students[0]
+
+    @staticmethod
+    def get_queries(teacher, student):
+        now = timezone.now()
+        return {
+            "teacher plans": MeetPlan.objects.filter(teacher_id=teacher.id, start_time__gt=now).order_by("start_time"),
+            "student plans": MeetPlan.objects.filter(student_id=student.id).order_by("start_time"),
+            "open slots": MeetPlan.objects.filter(student__isnull=True, start_time__gt=now).order_by("start_time"),
+            "term plans": MeetPlan.objects.get_queryset(start_date=get_start_date()).filter(complete=True),
+        }
+
+    @staticmethod
+    def set_indexes(enabled):
+        # sqlite refuses to enter the schema editor inside atomic(), so only borrow it to build the statements
+        schema_editor = connection.schema_editor(atomic=False)
+        with connection.cursor() as cursor:
+            for index in MeetPlan._meta.indexes:
+                if enabled:
+                    cursor.execute(str(index.create_sql(MeetPlan, schema_editor)))
+                else:
+                    cursor.execute(str(index.remove_sql(MeetPlan, schema_editor)))
+
+    @staticmethod
+    def run_queries(queries, repeat):
+        results = {}
+        for name, queryset in queries.items():
+            latencies = []
+            for _ in range(max(repeat, 1)):
+                start = time.perf_counter()
+                list(queryset.all()[:100])
+                latencies.append(time.perf_counter() - start)
+            results[name] = {"latency": statistics.median(latencies), "plan": queryset.explain()}
+        return results
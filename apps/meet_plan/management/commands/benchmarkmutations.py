@@ -0,0 +1,149 @@
+import statistics
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_relay import to_global_id
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import assign_perm
+
+from apps.meet_plan.models import MeetPlan
+from apps.meet_plan.schema import MeetPlanCreate, MeetPlanType
+from apps.user.models import User
+from apps.user.schema import UserType
+from MeetPlan.schema import schema
+
+OWNER_BACKEND = "apps.meet_plan.backends.MeetPlanOwnerBackend"
+
+CREATE = """
+mutation($input: MeetPlanCreateInput!){
+  meetPlanCreate(input: $input){ errors { message } }
+}
+"""
+UPDATE = """
+mutation($input: MeetPlanUpdateInput!){
+  meetPlanUpdate(input: $input){ errors { message } }
+}
+"""
+DELETE = """
+mutation($input: MeetPlanDeleteInput!){
+  meetPlanDelete(input: $input){ errors { message } }
+}
+"""
+
+
+def assign_owner_perms(cls, info, instance, cleaned_input=None):
+    # what MeetPlanCreate.after_save did before MeetPlanOwnerBackend
+    assign_perm("meet_plan.change_meetplan", instance.teacher, instance)
+    assign_perm("meet_plan.delete_meetplan", instance.teacher, instance)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the teacher mutations of meet plans with per-object guardian permissions "
+        "and with MeetPlanOwnerBackend. Sample rows are created in a transaction which is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plans", type=int, default=20000, help="Number of sample meet plans.")
+        parser.add_argument("--teachers", type=int, default=200, help="Number of sample teachers.")
+        parser.add_argument("--repeat", type=int, default=50, help="Times each mutation is executed.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            teachers, plans = self.populate(options["plans"], options["teachers"])
+            teacher, plan = teachers[0], plans[0]
+            guardian_backends = [backend for backend in settings.AUTHENTICATION_BACKENDS if backend != OWNER_BACKEND]
+
+            self.assign_perms(plans)
+            with override_settings(AUTHENTICATION_BACKENDS=guardian_backends), mock.patch.object(
+                MeetPlanCreate, "after_save", classmethod(assign_owner_perms)
+            ):
+                before = self.run_mutations(teacher, plan, options["repeat"])
+            UserObjectPermission.objects.filter(content_type=ContentType.objects.get_for_model(MeetPlan)).delete()
+            after = self.run_mutations(teacher, plan, options["repeat"])
+
+            transaction.set_rollback(True)
+
+        for name in before:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, result in (("guardian", before[name]), ("owner backend", after[name])):
+                self.stdout.write(f"  {label}: {result['latency'] * 1000:.3f} ms, {result['queries']} queries")
+        self.stdout.write(self.style.SUCCESS("Benchmark finished, sample data has been rolled back."))
+
+    @staticmethod
+    def populate(plans, teachers):
+        teachers = User.objects.bulk_create(
+            [User(pku_id=f"9{i:09d}", name=f"teacher{i}", is_teacher=True) for i in range(max(teachers, 1))]
+        )
+        # bulk_create does not return primary keys on every backend
+        teachers = list(User.objects.filter(pku_id__range=(teachers[0].pku_id, teachers[-1].pku_id)))
+        start_time = timezone.now() + timedelta(days=1)
+        MeetPlan.objects.bulk_create(
+            [
+                MeetPlan(
+                    teacher=teachers[i % len(teachers)],
+                    place="office",
+                    start_time=start_time + timedelta(minutes=30 * i),
+                )
+                for i in range(max(plans, 1))
+            ],
+            batch_size=5000,
+        )
+        return teachers, list(MeetPlan.objects.filter(teacher__in=teachers).order_by("pk"))
+
+    @staticmethod
+    def assign_perms(plans):
+        content_type = ContentType.objects.get_for_model(MeetPlan)
+        permissions = Permission.objects.filter(
+            content_type=content_type, codename__in=["change_meetplan", "delete_meetplan"]
+        )
+        UserObjectPermission.objects.bulk_create(
+            [
+                UserObjectPermission(
+                    permission=permission, user_id=plan.teacher_id, content_type=content_type, object_pk=str(plan.pk)
+                )
+                for plan in plans
+                for permission in permissions
+            ],
+            batch_size=5000,
+        )
+
+    @staticmethod
+    def run_mutations(teacher, plan, repeat):
+        request = RequestFactory().post("/graphql/")
+        request.user = teacher
+        plan_id = to_global_id(MeetPlanType._meta.name, str(plan.pk))
+        mutations = {
+            "meetPlanCreate": (
+                CREATE,
+                {
+                    "teacher": to_global_id(UserType._meta.name, str(teacher.pk)),
+                    "place": "office",
+                    "startTime": (timezone.now() + timedelta(days=1)).isoformat(),
+                },
+            ),
+            "meetPlanUpdate": (UPDATE, {"id": plan_id, "tMessage": "benchmark"}),
+            "meetPlanDelete": (DELETE, {"id": plan_id}),
+        }
+        results = {}
+        for name, (query, input_data) in mutations.items():
+            latencies = []
+            for _ in range(max(repeat, 1)):
+                sid = transaction.savepoint()
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    result = schema.execute(query, variable_values={"input": input_data}, context_value=request)
+                    latencies.append(time.perf_counter() - start)
+                transaction.savepoint_rollback(sid)
+                assert not result.errors and not result.data[name]["errors"], result
+            results[name] = {"latency": statistics.median(latencies), "queries": len(context.captured_queries)}
+        return results
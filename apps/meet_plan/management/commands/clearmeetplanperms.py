@@ -0,0 +1,27 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from guardian.models import UserObjectPermission
+
+from apps.meet_plan.backends import MeetPlanOwnerBackend
+from apps.meet_plan.models import MeetPlan
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the change/delete object permissions of meet plans stored by guardian, "
+        "they are answered from the teacher of the plan by MeetPlanOwnerBackend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only count the rows which would be deleted.")
+
+    def handle(self, *args, **options):
+        queryset = UserObjectPermission.objects.filter(
+            content_type=ContentType.objects.get_for_model(MeetPlan),
+            permission__codename__in=[perm.split(".", 1)[1] for perm in MeetPlanOwnerBackend.owner_perms],
+        )
+        if options["dry_run"]:
+            self.stdout.write(f"{queryset.count()} meet plan permissions would be deleted.")
+            return
+        deleted, _ = queryset.delete()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} meet plan permissions deleted."))
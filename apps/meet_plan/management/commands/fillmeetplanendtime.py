@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from apps.meet_plan.models import SLOT_DURATION, MeetPlan
+
+
+class Command(BaseCommand):
+    help = (
+        "Set the end time of meet plans saved before it was stored, "
+        "plans without end time are not taken into account by the overlap check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only count the plans which would be updated.")
+
+    def handle(self, *args, **options):
+        queryset = MeetPlan.objects.filter(end_time__isnull=True)
+        if options["dry_run"]:
+            self.stdout.write(f"{queryset.count()} meet plans would be updated.")
+            return
+        updated = 0
+        # one update per duration, adding a constant interval works on every database
+        for duration, _label in MeetPlan._meta.get_field("duration").choices:
+            updated += queryset.filter(duration=duration).update(end_time=F("start_time") + duration * SLOT_DURATION)
+        self.stdout.write(self.style.SUCCESS(f"{updated} meet plans updated."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.meet_plan.models import MeetPlanStat
+
+
+class Command(BaseCommand):
+    help = "Recount the meeting statistics of all terms from the meet plans."
+
+    def handle(self, *args, **options):
+        rows = MeetPlanStat.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"{rows} meet plan statistics rebuilt."))
@@ -1,17 +1,80 @@
-from datetime import datetime
+import uuid
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
 
 import pytz
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Trunc
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from graphene_django_plus.models import GuardedModel, GuardedModelManager
 
+TERM_DATE_VERSION_KEY = "meet_plan:term-date-version"
+
+# unit of MeetPlan.duration
+SLOT_DURATION = timedelta(minutes=30)
+OVERLAP_ERROR = _("This plan overlaps another plan of the teacher.")
+
+# (version, term date) of this process
+_term_date_cache = (None, None)
+# (version, [(start date, pk)] of all terms) of this process
+_term_starts_cache = (None, [])
+
+
+def get_term_date_version():
+    version = cache.get(TERM_DATE_VERSION_KEY)
+    if version is None:
+        cache.add(TERM_DATE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(TERM_DATE_VERSION_KEY)
+    return version
+
+
+def get_term_date():
+    """
+    The current (latest) TermDate, or ``None``.
+
+    It is kept in the process until the version stored in the django cache changes, which
+    happens when a TermDate is saved or deleted in any worker, see ``apps.meet_plan.signals``.
+    """
+    global _term_date_cache
+    version = get_term_date_version()
+    cached_version, term_date = _term_date_cache
+    if cached_version != version:
+        term_date = TermDate.objects.last()
+        _term_date_cache = (version, term_date)
+    return term_date
+
+
+def get_term_starts():
+    """``(start_date, pk)`` of all the terms in start order, kept in the process like ``get_term_date``."""
+    global _term_starts_cache
+    version = get_term_date_version()
+    cached_version, term_starts = _term_starts_cache
+    if cached_version != version:
+        term_starts = list(TermDate.objects.order_by("start_date").values_list("start_date", "pk"))
+        _term_starts_cache = (version, term_starts)
+    return term_starts
+
+
+def clear_term_date_cache(new_version=False):
+    """Forget the term dates of this process, and of all workers with ``new_version``."""
+    global _term_date_cache, _term_starts_cache
+    _term_date_cache = (None, None)
+    _term_starts_cache = (None, [])
+    if new_version:
+        cache.set(TERM_DATE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
 
 def get_start_date():
-    try:
-        start_date = TermDate.objects.get(pk=1).start_date
-    except TermDate.DoesNotExist:
+    term_date = get_term_date()
+    if term_date is not None:
+        start_date = term_date.start_date
+    else:
         now = timezone.now()
         if settings.USE_TZ:
             start_date = datetime(year=now.year, month=1, day=1).replace(tzinfo=pytz.utc)
@@ -20,12 +83,67 @@ def get_start_date():
     return start_date
 
 
-class MeetPlanManager(GuardedModelManager):
+def available_q(now):
+    return Q(start_time__gt=now, student__isnull=True)
+
+
+class MeetPlanQuerySet(models.QuerySet):
+    def annotate_available(self, now):
+        return self.annotate(
+            available=Case(
+                When(available_q(now), then=Value(True)),
+                output_field=models.BooleanField(),
+                default=Value(False),
+            ),
+        )
+
+    def filter_term(self, start_date, end_date=None):
+        queryset = self.filter(start_time__gt=start_date)
+        if end_date is not None:
+            queryset = queryset.filter(start_time__lte=end_date)
+        return queryset
+
+    def schedule(self, kind, now):
+        """
+        Count the plans per ``kind`` ("day" or "week") of their start time in ``settings.TIME_ZONE``,
+        with one aggregated query.
+        """
+        return (
+            self.annotate(bucket=Trunc("start_time", kind, tzinfo=timezone.get_default_timezone()))
+            .values("bucket")
+            .annotate(
+                total=Count("id"),
+                booked=Count("id", filter=Q(student__isnull=False)),
+                open=Count("id", filter=available_q(now)),
+                complete=Count("id", filter=Q(complete=True)),
+            )
+            .order_by("bucket")
+        )
+
+    def book(self, pk, student_id, s_message, now):
+        """
+        Give the plan ``pk`` to the student if it is still available, with a single conditional ``UPDATE``.
+        Returns if the plan has been booked, concurrent bookings of the same plan can not both succeed.
+        """
+        return bool(self.filter(available_q(now), pk=pk).update(student_id=student_id, s_message=s_message))
+
+    def overlapping(self, teacher_id, start_time, end_time):
+        """Plans of the teacher intersecting ``[start_time, end_time)``, a range scan of the teacher index."""
+        return self.filter(teacher_id=teacher_id, start_time__lt=end_time, end_time__gt=start_time)
+
+    def filter_available(self, available, now):
+        # filter on the condition itself instead of the annotation, so that the indexes can be used
+        if available:
+            return self.filter(available_q(now))
+        return self.exclude(available_q(now))
+
+
+class MeetPlanManager(GuardedModelManager.from_queryset(MeetPlanQuerySet)):
     def get_queryset(self, start_date=None):
         if start_date is None:
             return super(MeetPlanManager, self).get_queryset()
         else:
-            return super(MeetPlanManager, self).get_queryset().filter(start_time__gt=start_date)
+            return super(MeetPlanManager, self).get_queryset().filter_term(start_date)
 
 
 class MeetPlan(GuardedModel):
@@ -37,6 +155,8 @@ class MeetPlan(GuardedModel):
         choices=((1, _("half an hour")), (2, _("an hour")), (3, _("an hour and a half")), (4, _("two hours"))),
         default=1,
     )
+    # start_time + duration, stored for the overlap check, set on save
+    end_time = models.DateTimeField(_("end time"), null=True, blank=True, editable=False)
     t_message = models.TextField(_("teacher message"), blank=True)
     student = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, related_name="meet_plan_order", null=True, blank=True
@@ -49,16 +169,123 @@ class MeetPlan(GuardedModel):
     class Meta:
         verbose_name = _("meet plan")
         verbose_name_plural = _("meet plans")
+        indexes = [
+            # the plans of a teacher, covers the overlap check
+            models.Index(fields=["teacher", "start_time", "end_time"], name="meetplan_teacher_start_idx"),
+            models.Index(fields=["student", "start_time"], name="meetplan_student_start_idx"),
+            # keyset pagination of meetPlans
+            models.Index(fields=["start_time", "id"], name="meetplan_start_id_idx"),
+            # open slots in keyset order, only rows without a student are indexed
+            models.Index(
+                fields=["start_time", "id", "duration"],
+                name="meetplan_open_start_idx",
+                condition=Q(student__isnull=True),
+            ),
+        ]
 
     def is_available(self):
         now = timezone.now()
         return self.start_time > now and self.student is None
 
-    def save(self, **kwargs):
-        if self.student is None:
+    def get_end_time(self):
+        return self.start_time + self.duration * SLOT_DURATION
+
+    def check_overlap(self):
+        """Raise a ``ValidationError`` if another plan of the teacher intersects this one, with one query."""
+        overlapping = MeetPlan.objects.overlapping(self.teacher_id, self.start_time, self.get_end_time())
+        if self.pk is not None:
+            overlapping = overlapping.exclude(pk=self.pk)
+        if overlapping.exists():
+            raise ValidationError({"start_time": OVERLAP_ERROR})
+
+    def overlaps(self, other):
+        return (
+            self.teacher_id == other.teacher_id
+            and self.start_time < other.get_end_time()
+            and other.start_time < self.get_end_time()
+        )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the stored values counted in MeetPlanStat, the counts are only updated when they change
+        if all(field in instance.__dict__ for field in STAT_FIELDS):
+            instance._stored_stat_values = {field: instance.__dict__[field] for field in STAT_FIELDS}
+        return instance
+
+    def get_stat_values(self, stored=None):
+        """
+        The values of ``STAT_VALUES``, to count the plan in ``MeetPlanStat``. The department of the teacher
+        is the one of the ``stored`` values if the teacher is the same, the teacher is not loaded for it.
+        """
+        values = {field: getattr(self, field) for field in STAT_FIELDS}
+        if stored and stored["teacher_id"] == self.teacher_id and "teacher__department_id" in stored:
+            values["teacher__department_id"] = stored["teacher__department_id"]
+        elif MeetPlan.teacher.is_cached(self):
+            values["teacher__department_id"] = self.teacher.department_id
+        else:
+            teachers = MeetPlan.teacher.field.related_model.objects.filter(pk=self.teacher_id)
+            values["teacher__department_id"] = teachers.values_list("department_id", flat=True).first()
+        return values
+
+    def clear_order(self):
+        """A plan without student has neither student message nor completion, called on save."""
+        if self.student_id is None:
             self.s_message = ""
             self.complete = False
-        super().save(kwargs)
+
+    def save(self, **kwargs):
+        self.clear_order()
+        self.end_time = self.get_end_time()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"start_time", "duration"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "end_time"}
+        super().save(**kwargs)
+
+
+class WaitlistEntryQuerySet(models.QuerySet):
+    def waiting(self):
+        """Entries without a plan yet, first come first served."""
+        return self.filter(meet_plan__isnull=True).order_by("created", "id")
+
+
+class WaitlistEntry(GuardedModel):
+    """A student waiting for the next free plan of a teacher, see ``apps.meet_plan.tasks.assign_waitlist``."""
+
+    teacher = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="waitlist")
+    student = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="waitlist_entries")
+    s_message = models.TextField(_("student message"), blank=True)
+    created = models.DateTimeField(_("created"), auto_now_add=True)
+    # a plan whose student is cleared again can be assigned to several entries over time
+    meet_plan = models.ForeignKey(
+        MeetPlan, on_delete=models.CASCADE, related_name="waitlist_entries", null=True, blank=True
+    )
+
+    objects = GuardedModelManager.from_queryset(WaitlistEntryQuerySet)()
+
+    class Meta:
+        verbose_name = _("waitlist entry")
+        verbose_name_plural = _("waitlist entries")
+        indexes = [
+            # the queue of a teacher, assigned entries are not indexed
+            models.Index(
+                fields=["teacher", "created", "id"], name="waitlist_queue_idx", condition=Q(meet_plan__isnull=True)
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["teacher", "student"], name="waitlist_unique_waiting", condition=Q(meet_plan__isnull=True)
+            ),
+        ]
+
+    def get_position(self):
+        """1-based place in the queue of the teacher, ``None`` once a plan has been assigned."""
+        if self.meet_plan_id is not None:
+            return None
+        ahead = WaitlistEntry.objects.waiting().filter(
+            Q(created__lt=self.created) | Q(created=self.created, id__lt=self.id), teacher_id=self.teacher_id
+        )
+        return ahead.count() + 1
 
 
 class TermDate(GuardedModel):
@@ -66,3 +293,132 @@ class TermDate(GuardedModel):
 
     class Meta:
         verbose_name = _("term date")
+
+    def get_end_date(self):
+        """Start date of the following term, ``None`` for the current one."""
+        return (
+            TermDate.objects.filter(start_date__gt=self.start_date)
+            .order_by("start_date")
+            .values_list("start_date", flat=True)
+            .first()
+        )
+
+
+# what MeetPlanStat needs to know about a plan
+STAT_FIELDS = ("teacher_id", "student_id", "start_time", "complete")
+STAT_VALUES = (*STAT_FIELDS, "teacher__department_id")
+
+
+class MeetPlanStatManager(models.Manager):
+    @staticmethod
+    def get_term_ids(start_times):
+        """The term of each start time, like ``MeetPlanQuerySet.filter_term``: the latest one starting before."""
+        terms = get_term_starts()
+        start_dates = [start_date for start_date, _pk in terms]
+        term_ids = {}
+        for start_time in start_times:
+            i = bisect_left(start_dates, start_time)
+            term_ids[start_time] = terms[i - 1][1] if i else None
+        return term_ids
+
+    def get_keys(self, plans):
+        """The rows counting the plans, given as dicts of ``STAT_VALUES``. Plans without student are no meetings."""
+        plans = [plan for plan in plans if plan["student_id"] is not None]
+        if not plans:
+            return []
+        term_ids = self.get_term_ids({plan["start_time"] for plan in plans})
+        keys = []
+        for plan in plans:
+            term_id = term_ids[plan["start_time"]]
+            if term_id is None:
+                continue
+            keys += [
+                (term_id, MeetPlanStat.TEACHER, plan["teacher_id"], plan["complete"]),
+                (term_id, MeetPlanStat.STUDENT, plan["student_id"], plan["complete"]),
+                (term_id, MeetPlanStat.DEPARTMENT, plan["teacher__department_id"], plan["complete"]),
+            ]
+        return keys
+
+    def get_plan_keys(self, **filters):
+        return self.get_keys(MeetPlan.objects.filter(**filters).values(*STAT_VALUES))
+
+    def update_counts(self, removed, added):
+        """Apply the difference between the rows which counted the changed plans and the rows counting them now."""
+        delta = Counter(added)
+        delta.subtract(removed)
+        for (term_id, group_by, key, complete), count in delta.items():
+            if not count:
+                continue
+            lookup = {"term_id": term_id, "group_by": group_by, "key": key, "complete": complete}
+            if self.filter(**lookup).update(count=F("count") + count):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(count=count, **lookup)
+            except IntegrityError:
+                # created concurrently
+                self.filter(**lookup).update(count=F("count") + count)
+
+    def rebuild(self):
+        """Recount all terms from ``MeetPlan``, with one aggregated query per grouping."""
+        term = TermDate.objects.filter(start_date__lt=OuterRef("start_time")).order_by("-start_date").values("pk")
+        plans = MeetPlan.objects.filter(student__isnull=False).annotate(stat_term=Subquery(term[:1]))
+        plans = plans.filter(stat_term__isnull=False)
+        stats = []
+        for group_by, field in (
+            (MeetPlanStat.TEACHER, "teacher_id"),
+            (MeetPlanStat.STUDENT, "student_id"),
+            (MeetPlanStat.DEPARTMENT, "teacher__department_id"),
+        ):
+            rows = plans.values("stat_term", field, "complete").annotate(count=Count("id")).order_by()
+            stats += [
+                MeetPlanStat(
+                    term_id=row["stat_term"],
+                    group_by=group_by,
+                    key=row[field],
+                    complete=row["complete"],
+                    count=row["count"],
+                )
+                for row in rows
+            ]
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(stats)
+        return len(stats)
+
+
+class MeetPlanStat(models.Model):
+    """
+    Number of meetings (plans with a student) per term, teacher / student / department of the teacher
+    and completion.
+
+    The counts are updated with the changes of the plans, see ``apps.meet_plan.signals``, and
+    recomputed by ``manage.py rebuildmeetplanstats`` and when the term dates change.
+    """
+
+    TEACHER = "teacher"
+    STUDENT = "student"
+    DEPARTMENT = "department"
+
+    term = models.ForeignKey(TermDate, on_delete=models.CASCADE, related_name="meet_plan_stats")
+    group_by = models.CharField(
+        _("group by"),
+        max_length=10,
+        choices=((TEACHER, _("teacher")), (STUDENT, _("student")), (DEPARTMENT, _("department"))),
+    )
+    # id of the teacher, student or department, null for teachers without department
+    key = models.BigIntegerField(_("key"), null=True)
+    complete = models.BooleanField(_("status"))
+    count = models.IntegerField(_("count"), default=0)
+
+    objects = MeetPlanStatManager()
+
+    class Meta:
+        verbose_name = _("meet plan statistic")
+        verbose_name_plural = _("meet plan statistics")
+        constraints = [
+            models.UniqueConstraint(fields=["term", "group_by", "key", "complete"], name="meetplanstat_unique"),
+            models.UniqueConstraint(
+                fields=["term", "group_by", "complete"], name="meetplanstat_unique_null", condition=Q(key__isnull=True)
+            ),
+        ]
@@ -1,17 +1,31 @@
 from .query import (
     TermDateType,
     MeetPlanType,
+    WaitlistEntryType,
     Query,
 )
-from .mutation import TermDateCreate, MeetPlanCreate, MeetPlanUpdate, MeetPlanDelete, Mutation
+from .mutation import (
+    TermDateCreate,
+    MeetPlanCreate,
+    MeetPlanBulkCreate,
+    MeetPlanUpdate,
+    MeetPlanBook,
+    MeetPlanWaitlistJoin,
+    MeetPlanDelete,
+    Mutation,
+)
 
 __all__ = [
     "TermDateType",
     "MeetPlanType",
+    "WaitlistEntryType",
     "Query",
     "TermDateCreate",
     "MeetPlanCreate",
+    "MeetPlanBulkCreate",
     "MeetPlanUpdate",
+    "MeetPlanBook",
+    "MeetPlanWaitlistJoin",
     "MeetPlanDelete",
     "Mutation",
 ]
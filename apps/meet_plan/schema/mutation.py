@@ -1,12 +1,20 @@
 import graphene
-from django.core.exceptions import ValidationError
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from graphene.utils.str_converters import to_camel_case
 from graphene_django_plus.exceptions import PermissionDenied
-from graphene_django_plus.mutations import ModelCreateMutation, ModelUpdateMutation, ModelDeleteMutation
-from guardian.shortcuts import assign_perm
+from graphene_django_plus.mutations import BaseMutation, ModelCreateMutation, ModelUpdateMutation, ModelDeleteMutation
+from graphql_relay import from_global_id
 
-from apps.meet_plan.models import TermDate, MeetPlan
+from apps.meet_plan.models import OVERLAP_ERROR, TermDate, MeetPlan, MeetPlanStat, WaitlistEntry
+from apps.meet_plan.schema.query import MeetPlanType, WaitlistEntryType
+from apps.meet_plan.tasks import count_booked_meet_plans, enqueue_assign_waitlist
+from apps.pku_auth.connection import invalidate_counts
+from apps.user.models import User
+from apps.user.schema import UserType
 
 
 class TermDateCreate(ModelCreateMutation):
@@ -49,9 +57,172 @@ class MeetPlanCreate(ModelCreateMutation):
                 )
 
     @classmethod
-    def after_save(cls, info, instance, cleaned_input=None):
-        assign_perm("meet_plan.change_meetplan", instance.teacher, instance)
-        assign_perm("meet_plan.delete_meetplan", instance.teacher, instance)
+    def clean_instance(cls, instance, clean_input):
+        super().clean_instance(instance, clean_input)
+        instance.check_overlap()
+
+
+class MeetPlanInput(graphene.InputObjectType):
+    teacher = graphene.ID(required=True)
+    place = graphene.String(required=True)
+    start_time = graphene.DateTime(required=True)
+    duration = graphene.Int()
+    t_message = graphene.String()
+    student = graphene.ID()
+    s_message = graphene.String()
+    complete = graphene.Boolean()
+
+
+class MeetPlanBulkCreate(BaseMutation):
+    """
+    Create several meet plans at once, e.g. the slots of a term.
+
+    All items are validated with the rules of ``MeetPlanCreate`` before anything is written,
+    then the plans are inserted with one query.
+    Either all plans are created or none.
+    """
+
+    MAX_ITEMS = 200
+
+    class Input:
+        meet_plans = graphene.List(graphene.NonNull(MeetPlanInput), required=True)
+
+    meet_plans = graphene.List(graphene.NonNull(MeetPlanType), description="The created meet plans.")
+
+    @classmethod
+    @transaction.atomic
+    def perform_mutation(cls, root, info, **data):
+        items = data["meet_plans"]
+        if len(items) > cls.MAX_ITEMS:
+            raise ValidationError(
+                {"meet_plans": _("At most %(max)d meet plans can be created at once.") % {"max": cls.MAX_ITEMS}}
+            )
+
+        users = cls.get_users(items)
+        errors, instances = {}, {}
+        for i, item in enumerate(items):
+            try:
+                instance = cls.clean_item(info, item, users)
+                if any(instance.overlaps(other) for other in instances.values()):
+                    raise ValidationError({"start_time": OVERLAP_ERROR})
+                instances[i] = instance
+            except ValidationError as e:
+                cls.add_item_errors(errors, i, e)
+        for i in cls.find_stored_overlaps(instances):
+            cls.add_item_errors(errors, i, ValidationError({"start_time": OVERLAP_ERROR}))
+        if errors:
+            raise ValidationError(errors)
+
+        meet_plans = MeetPlan.objects.bulk_create(instances.values())
+        if meet_plans and meet_plans[0].pk is None:
+            cls.fetch_pks(meet_plans)
+        # bulk_create() does not send post_save
+        invalidate_counts(MeetPlan)
+        MeetPlanStat.objects.update_counts(
+            [],
+            MeetPlanStat.objects.get_keys(
+                meet_plan.get_stat_values() for meet_plan in meet_plans if meet_plan.student_id is not None
+            ),
+        )
+        now = timezone.now()
+        enqueue_assign_waitlist(
+            meet_plan.teacher_id
+            for meet_plan in meet_plans
+            if meet_plan.student_id is None and meet_plan.start_time > now
+        )
+        return cls(meet_plans=meet_plans)
+
+    @staticmethod
+    def get_users(items):
+        """The teachers and students of all items, by global id, fetched with one query."""
+        ids = {}
+        for item in items:
+            for node_id in (item.get("teacher"), item.get("student")):
+                if not node_id:
+                    continue
+                try:
+                    _type, pk = from_global_id(node_id)
+                    pk = User._meta.pk.to_python(pk)
+                except (TypeError, ValueError, UnicodeDecodeError, ValidationError):
+                    continue
+                if _type == UserType._meta.name:
+                    ids[node_id] = pk
+        users = User.objects.in_bulk(set(ids.values()))
+        return {node_id: users[pk] for node_id, pk in ids.items() if pk in users}
+
+    @staticmethod
+    def get_user(users, item, field):
+        if not item.get(field):
+            return None
+        if item[field] not in users:
+            raise ValidationError({field: "Couldn't resolve to a node: {}".format(item[field])})
+        return users[item[field]]
+
+    @classmethod
+    def clean_item(cls, info, item, users):
+        instance = MeetPlan(
+            teacher=cls.get_user(users, item, "teacher"),
+            student=cls.get_user(users, item, "student"),
+            place=item["place"],
+            start_time=item["start_time"],
+        )
+        for field in ("duration", "t_message", "s_message", "complete"):
+            if item.get(field) is not None:
+                setattr(instance, field, item[field])
+        # the users have been fetched already, skip the query of the foreign key validation
+        instance.full_clean(exclude=["teacher", "student"])
+        MeetPlanCreate.before_save(info, instance)
+        # bulk_create() does not call save()
+        instance.clear_order()
+        instance.end_time = instance.get_end_time()
+        return instance
+
+    @staticmethod
+    def find_stored_overlaps(instances):
+        """
+        Indexes of the plans intersecting a stored plan of their teacher, with one query for the
+        whole batch: the range of every teacher is scanned on the teacher index and compared here.
+        """
+        ranges = {}
+        for instance in instances.values():
+            start_time, end_time = ranges.get(instance.teacher_id, (instance.start_time, instance.end_time))
+            ranges[instance.teacher_id] = (min(start_time, instance.start_time), max(end_time, instance.end_time))
+        if not ranges:
+            return []
+        condition = Q()
+        for teacher_id, (start_time, end_time) in ranges.items():
+            condition |= Q(teacher_id=teacher_id, start_time__lt=end_time, end_time__gt=start_time)
+        stored = list(MeetPlan.objects.filter(condition).only("teacher", "start_time", "duration"))
+        return [i for i, instance in instances.items() if any(instance.overlaps(plan) for plan in stored)]
+
+    @classmethod
+    def add_item_errors(cls, errors, i, error):
+        for field, messages in cls.get_error_messages(error).items():
+            errors[f"meetPlans.{i}.{field}"] = messages
+
+    @staticmethod
+    def get_error_messages(error):
+        if not hasattr(error, "error_dict"):
+            return {"nonField": error.messages}
+        return {
+            "nonField" if field == NON_FIELD_ERRORS else to_camel_case(field): messages
+            for field, messages in error.message_dict.items()
+        }
+
+    @staticmethod
+    def fetch_pks(meet_plans):
+        # the database did not return the primary keys, the new rows are the latest ones of their slot
+        rows = (
+            MeetPlan.objects.filter(
+                teacher_id__in={meet_plan.teacher_id for meet_plan in meet_plans},
+                start_time__in={meet_plan.start_time for meet_plan in meet_plans},
+            )
+            .order_by("pk")
+            .values_list("pk", "teacher_id", "start_time")
+        )
+        pks = {(teacher_id, start_time): pk for pk, teacher_id, start_time in rows}
+        for meet_plan in meet_plans:
+            meet_plan.pk = pks[(meet_plan.teacher_id, meet_plan.start_time)]
 
 
 class MeetPlanUpdate(ModelUpdateMutation):
@@ -107,6 +278,12 @@ class MeetPlanUpdate(ModelUpdateMutation):
 
         return cleaned_input
 
+    @classmethod
+    def clean_instance(cls, instance, clean_input):
+        super().clean_instance(instance, clean_input)
+        if {"teacher", "start_time", "duration"} & clean_input.keys():
+            instance.check_overlap()
+
     @classmethod
     def before_save(cls, info, instance, cleaned_input=None):
         user = info.context.user
@@ -121,6 +298,90 @@ class MeetPlanUpdate(ModelUpdateMutation):
                 raise ValidationError({"start_time": _("You can not change previous plan.")})
 
 
+class MeetPlanBook(BaseMutation):
+    """
+    Book an available meet plan for the current student.
+
+    The plan is claimed with one conditional update instead of loading and saving it, so that
+    concurrent bookings of the same plan can not both succeed and the write lock is held shortly.
+    """
+
+    class Input:
+        id = graphene.ID(required=True)
+        s_message = graphene.String()
+
+    meet_plan = graphene.Field(MeetPlanType, description="The booked meet plan.")
+
+    @staticmethod
+    def resolve_meet_plan(root, info):
+        # only fetched when asked for
+        if root.meet_plan is None:
+            return None
+        return MeetPlanType.get_queryset(MeetPlan.objects.all(), info).get(pk=root.meet_plan)
+
+    @classmethod
+    def perform_mutation(cls, root, info, **data):
+        user = info.context.user
+        if user.is_teacher:
+            raise ValidationError({"student": _("Only students can book meet plans.")})
+        try:
+            _type, pk = from_global_id(data["id"])
+            pk = MeetPlan._meta.pk.to_python(pk)
+        except (TypeError, ValueError, UnicodeDecodeError, ValidationError):
+            _type = None
+        if _type != MeetPlanType._meta.name:
+            raise ValidationError({"id": _("Invalid meet plan id.")})
+
+        if not MeetPlan.objects.book(pk, user.id, data.get("s_message") or "", timezone.now()):
+            raise ValidationError(
+                {"id": _("This meet plan is not available, it may have been booked by someone else.")}
+            )
+        # update() does not send post_save
+        invalidate_counts(MeetPlan)
+        transaction.on_commit(lambda: count_booked_meet_plans.delay([pk]))
+        return cls(meet_plan=pk)
+
+
+class MeetPlanWaitlistJoin(BaseMutation):
+    """
+    Wait for the next free plan of a teacher instead of polling ``meetPlans``.
+
+    Published plans and plans whose student has been cleared are given to the waiting
+    students in the order they joined, by ``apps.meet_plan.tasks.assign_waitlist`` in the background.
+    """
+
+    class Input:
+        teacher = graphene.ID(required=True)
+        s_message = graphene.String()
+
+    waitlist_entry = graphene.Field(WaitlistEntryType)
+
+    @classmethod
+    def perform_mutation(cls, root, info, **data):
+        user = info.context.user
+        if user.is_teacher:
+            raise ValidationError({"student": _("Only students can join a waitlist.")})
+        try:
+            _type, pk = from_global_id(data["teacher"])
+            pk = User._meta.pk.to_python(pk)
+        except (TypeError, ValueError, UnicodeDecodeError, ValidationError):
+            _type = None
+        teacher = User.objects.filter(pk=pk, is_teacher=True).first() if _type == UserType._meta.name else None
+        if teacher is None:
+            raise ValidationError({"teacher": _("Invalid teacher id.")})
+
+        try:
+            with transaction.atomic():
+                entry = WaitlistEntry.objects.create(
+                    teacher=teacher, student=user, s_message=data.get("s_message") or ""
+                )
+        except IntegrityError:
+            raise ValidationError({"teacher": _("You are already on the waitlist of this teacher.")})
+        # a plan may be free already
+        enqueue_assign_waitlist([teacher.id])
+        return cls(waitlist_entry=entry)
+
+
 class MeetPlanDelete(ModelDeleteMutation):
     class Meta:
         model = MeetPlan
@@ -146,5 +407,8 @@ class Mutation(graphene.ObjectType):
     term_date_update = TermDateCreate.Field()
 
     meet_plan_create = MeetPlanCreate.Field()
+    meet_plan_bulk_create = MeetPlanBulkCreate.Field()
     meet_plan_update = MeetPlanUpdate.Field()
+    meet_plan_book = MeetPlanBook.Field()
+    meet_plan_waitlist_join = MeetPlanWaitlistJoin.Field()
     meet_plan_delete = MeetPlanDelete.Field()
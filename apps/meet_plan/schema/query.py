@@ -1,12 +1,20 @@
 import graphene
+from django.core.exceptions import ValidationError
+from django.db.models import Q, Sum
+from django.utils.translation import gettext, gettext_lazy as _
 from graphene import relay
-from graphene_django.filter import DjangoFilterConnectionField
 from graphene_django_plus.types import ModelType
+from graphql_jwt.decorators import login_required
 from graphql_jwt.exceptions import PermissionDenied
+from graphql_relay import from_global_id
 
-from apps.meet_plan.models import MeetPlan, TermDate
+from apps.meet_plan.filters import MeetPlanFilter
+from apps.meet_plan.models import MeetPlan, MeetPlanStat, TermDate, WaitlistEntry, available_q, get_term_date
+from apps.meet_plan.utils import get_request_now
+from apps.pku_auth.fields import FilterConnectionField
 from apps.pku_auth.meta import PKTypeMixin, AbstractMeta
-from apps.user.schema import UserType
+from apps.user.loaders import get_loaders, load_related, queue_related
+from apps.user.schema import DepartmentType, UserType
 
 
 class TermDateType(ModelType):
@@ -30,19 +38,23 @@ class MeetPlanType(PKTypeMixin, ModelType):
             # "s_message",
             # "complete",
         ]
-        filter_fields = {
-            "teacher__id": ["exact", "in"],
-            "start_time": ["lt", "gt"],
-            "duration": ["exact", "in", "gte", "lte"],
-            # TODO: make student__pku_id filter only for admin user to protect privacy
-            "student__pku_id": ["exact", "contains", "startswith"],
-            "complete": ["exact"],
-        }
+        filterset_class = MeetPlanFilter
+
+    keyset_fields = ("start_time", "id")
+    count_strategy = "cached"
+
+    teacher = graphene.Field(UserType, required=True)
+
+    @staticmethod
+    def resolve_teacher(parent, info):
+        return load_related(info, parent, "teacher", "user")
 
     available = graphene.Boolean()
 
     @staticmethod
     def resolve_available(parent, info):
+        if hasattr(parent, "available"):
+            return parent.available
         return parent.is_available()
 
     student = graphene.Field(UserType)
@@ -51,11 +63,11 @@ class MeetPlanType(PKTypeMixin, ModelType):
     def resolve_student(parent, info):
         user = info.context.user
         if user.is_admin:
-            return parent.student
+            return load_related(info, parent, "student", "user")
         if user.is_teacher and user.id == parent.teacher_id:
-            return parent.student
+            return load_related(info, parent, "student", "user")
         if user.id == parent.student_id:
-            return parent.student
+            return load_related(info, parent, "student", "user")
         raise PermissionDenied
 
     s_message = graphene.String()
@@ -86,7 +98,8 @@ class MeetPlanType(PKTypeMixin, ModelType):
 
     @classmethod
     def get_queryset(cls, qs, info):
-        qs = super().get_queryset(qs, info)
+        # an explicit order, the rows of a term would otherwise come in the order of the start_time index
+        qs = super().get_queryset(qs, info).annotate_available(get_request_now(info.context)).order_by("id")
         user = info.context.user
         if user.is_admin:
             return qs
@@ -94,13 +107,172 @@ class MeetPlanType(PKTypeMixin, ModelType):
             return qs.filter(teacher_id=user.id)
         return qs
 
+    @classmethod
+    def prime(cls, info, instances):
+        queue_related(info, instances, "teacher", "user")
+        queue_related(info, instances, "student", "user")
+
+
+class WaitlistEntryType(PKTypeMixin, ModelType):
+    class Meta(AbstractMeta):
+        model = WaitlistEntry
+        fields = ["teacher", "student", "s_message", "created", "meet_plan"]
+
+    position = graphene.Int(description=_("Place in the queue of the teacher, null once a plan has been assigned."))
+
+    @staticmethod
+    def resolve_position(parent, info):
+        return parent.get_position()
+
+    @classmethod
+    def get_queryset(cls, qs, info):
+        qs = super().get_queryset(qs, info)
+        user = info.context.user
+        if user.is_admin:
+            return qs
+        if user.is_teacher:
+            return qs.filter(teacher_id=user.id)
+        return qs.filter(student_id=user.id)
+
+
+class ScheduleGranularity(graphene.Enum):
+    DAY = "day"
+    WEEK = "week"
+
+
+class ScheduleBucketType(graphene.ObjectType):
+    start = graphene.DateTime(required=True, description=_("Start of the day or week, in the server time zone."))
+    total = graphene.Int(required=True)
+    booked = graphene.Int(description=_("Plans with a student, only for admins and the teacher."))
+    open = graphene.Int(required=True, description=_("Plans which can still be booked."))
+    complete = graphene.Int(description=_("Only for admins and the teacher."))
+
+
+class MeetPlanStatsGroupBy(graphene.Enum):
+    TEACHER = MeetPlanStat.TEACHER
+    STUDENT = MeetPlanStat.STUDENT
+    DEPARTMENT = MeetPlanStat.DEPARTMENT
+
+
+class MeetPlanStatsRowType(graphene.ObjectType):
+    teacher = graphene.Field(UserType, description=_("Set when grouped by teacher."))
+    student = graphene.Field(UserType, description=_("Set when grouped by student."))
+    department = graphene.Field(
+        DepartmentType, description=_("Department of the teacher, null for teachers without department.")
+    )
+    total = graphene.Int(required=True)
+    complete = graphene.Int(required=True)
+    incomplete = graphene.Int(required=True)
+
 
 class Query(graphene.ObjectType):
     term_date = graphene.Field(TermDateType)
 
     @staticmethod
     def resolve_term_date(parent, info):
-        return TermDate.objects.last()
+        return get_term_date()
+
+    term_dates = graphene.List(graphene.NonNull(TermDateType), required=True)
+
+    @staticmethod
+    def resolve_term_dates(parent, info):
+        return TermDate.objects.order_by("start_date")
+
+    teacher_schedule = graphene.List(
+        graphene.NonNull(ScheduleBucketType),
+        required=True,
+        teacher_id=graphene.Int(required=True),
+        from_=graphene.DateTime(name="from", required=True),
+        to=graphene.DateTime(required=True),
+        granularity=ScheduleGranularity(default_value=ScheduleGranularity.DAY),
+        description=_("Plans of a teacher in [from, to) counted per day or week, days without plan are left out."),
+    )
+
+    @staticmethod
+    @login_required
+    def resolve_teacher_schedule(parent, info, teacher_id, from_, to, granularity=ScheduleGranularity.DAY):
+        if from_ >= to:
+            raise ValidationError(gettext("from should be earlier than to."))
+        qs = MeetPlanType.get_queryset(MeetPlan.objects.all(), info)
+        qs = qs.filter(teacher_id=teacher_id, start_time__gte=from_, start_time__lt=to)
+        rows = list(qs.schedule(granularity.value, get_request_now(info.context)))
+        user = info.context.user
+        if not user.is_admin and user.id != teacher_id:
+            # like the student and complete fields of the plans
+            for row in rows:
+                row.update(booked=None, complete=None)
+        return [ScheduleBucketType(start=row.pop("bucket"), **row) for row in rows]
+
+    meet_plan_stats = graphene.List(
+        graphene.NonNull(MeetPlanStatsRowType),
+        required=True,
+        group_by=MeetPlanStatsGroupBy(required=True),
+        term=graphene.ID(description=_("Global id of a term date, the current term by default.")),
+        description=_("Meetings (plans with a student) of a term, the most first. Only for admins."),
+    )
+
+    @staticmethod
+    @login_required
+    def resolve_meet_plan_stats(parent, info, group_by, term=None):
+        if not info.context.user.is_admin:
+            raise PermissionDenied
+        if term is None:
+            term_date = get_term_date()
+            term_id = term_date.pk if term_date is not None else None
+        else:
+            try:
+                _type, term_id = from_global_id(term)
+                term_id = TermDate._meta.pk.to_python(term_id)
+            except (TypeError, ValueError, UnicodeDecodeError, ValidationError):
+                _type = None
+            if _type != TermDateType._meta.name:
+                raise ValidationError(gettext("Invalid term."))
+
+        # read from the summary table, see MeetPlanStat
+        rows = list(
+            MeetPlanStat.objects.filter(term_id=term_id, group_by=group_by.value)
+            .values("key")
+            .annotate(total=Sum("count"), complete=Sum("count", filter=Q(complete=True)))
+            .filter(total__gt=0)
+            .order_by("-total", "key")
+        )
+        loaders = get_loaders(info)
+        loader = loaders.department if group_by == MeetPlanStatsGroupBy.DEPARTMENT else loaders.user
+        loader.queue(row["key"] for row in rows)
+        return [
+            MeetPlanStatsRowType(
+                total=row["total"],
+                complete=row["complete"] or 0,
+                incomplete=row["total"] - (row["complete"] or 0),
+                **{group_by.value: loader.load(row["key"])},
+            )
+            for row in rows
+        ]
 
     meet_plan = relay.Node.Field(MeetPlanType)
-    meet_plans = DjangoFilterConnectionField(MeetPlanType)
+    meet_plans = FilterConnectionField(MeetPlanType)
+
+    free_slots = FilterConnectionField(
+        MeetPlanType,
+        keyset_only=True,
+        from_=graphene.DateTime(name="from", required=True),
+        to=graphene.DateTime(required=True),
+        min_duration=graphene.Int(description=_("Minimal duration, in half hours.")),
+        department_id=graphene.Int(description=_("Department of the teacher.")),
+        description=_("Plans which can still be booked within [from, to], ordered by start time."),
+    )
+
+    @staticmethod
+    @login_required
+    def resolve_free_slots(parent, info, from_, to, min_duration=None, department_id=None, **kwargs):
+        if from_ >= to:
+            raise ValidationError(gettext("from should be earlier than to."))
+        qs = MeetPlan.objects.filter(
+            available_q(get_request_now(info.context)), start_time__gte=from_, end_time__lte=to
+        )
+        if min_duration is not None:
+            qs = qs.filter(duration__gte=min_duration)
+        if department_id is not None:
+            # department_id is a column of the teacher row, joined in the same query
+            qs = qs.filter(teacher__department_id=department_id)
+        return qs
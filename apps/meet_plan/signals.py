@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.utils import timezone
+
+from apps.meet_plan.models import STAT_FIELDS, STAT_VALUES, MeetPlan, MeetPlanStat, clear_term_date_cache
+from apps.meet_plan.tasks import enqueue_assign_waitlist, rebuild_meet_plan_stats
+
+
+def term_date_changed_callback(sender, **kwargs):
+    # drop the term date of this process at once, the other workers reload it once the change is committed
+    clear_term_date_cache()
+    transaction.on_commit(lambda: clear_term_date_cache(new_version=True))
+    # the plans may belong to another term now
+    transaction.on_commit(rebuild_meet_plan_stats.delay)
+
+
+def meet_plan_saved_callback(sender, instance, raw=False, **kwargs):
+    # a new plan or a plan whose student has been cleared goes to the waitlist of the teacher
+    if not raw and instance.student_id is None and instance.start_time > timezone.now():
+        enqueue_assign_waitlist([instance.teacher_id])
+
+
+def meet_plan_stats_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    # the rows counting the plan as it is stored, only read when the counted values change
+    instance.__dict__.pop("_stat_keys", None)
+    if raw:
+        return
+    if instance._state.adding:
+        instance._stat_keys = []
+        return
+    if update_fields is not None:
+        saved_fields = {sender._meta.get_field(name).attname for name in update_fields}
+        if not saved_fields.intersection(STAT_FIELDS):
+            return
+    stored = getattr(instance, "_stored_stat_values", None)
+    if stored is not None and all(stored[field] == getattr(instance, field) for field in STAT_FIELDS):
+        return
+    if stored is None or "teacher__department_id" not in stored:
+        stored = MeetPlan.objects.filter(pk=instance.pk).values(*STAT_VALUES).first()
+    instance._stored_stat_values = stored
+    instance._stat_keys = MeetPlanStat.objects.get_keys([stored] if stored is not None else [])
+
+
+def meet_plan_stats_post_save(sender, instance, raw=False, **kwargs):
+    removed = instance.__dict__.pop("_stat_keys", None)
+    if raw or removed is None:
+        # the counted values are unchanged
+        return
+    stored = getattr(instance, "_stored_stat_values", None)
+    if instance.student_id is not None:
+        values = instance.get_stat_values(stored)
+    else:
+        values = {field: getattr(instance, field) for field in STAT_FIELDS}
+    MeetPlanStat.objects.update_counts(removed, MeetPlanStat.objects.get_keys([values]))
+    # the next save of this instance reads the row again, it may be changed meanwhile, e.g. by book()
+    instance.__dict__.pop("_stored_stat_values", None)
+
+
+def meet_plan_stats_post_delete(sender, instance, **kwargs):
+    if instance.student_id is not None:
+        values = instance.get_stat_values(getattr(instance, "_stored_stat_values", None))
+        MeetPlanStat.objects.update_counts(MeetPlanStat.objects.get_keys([values]), [])
@@ -0,0 +1,86 @@
+from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
+
+from apps.meet_plan.models import MeetPlan, MeetPlanStat, WaitlistEntry, available_q
+from apps.pku_auth.connection import invalidate_counts
+
+
+def enqueue_assign_waitlist(teacher_ids):
+    """Assign the free plans of the teachers once the current transaction is committed and visible to the worker."""
+    for teacher_id in set(teacher_ids):
+        transaction.on_commit(lambda teacher_id=teacher_id: assign_waitlist.delay(teacher_id))
+
+
+def assign_next(teacher_id, now):
+    """
+    Give the earliest open plan of the teacher to the first waiting student.
+
+    Returns ``None`` when there is nothing left to assign, and ``False`` when the plan has been
+    booked by someone else in between, in which case the next plan should be tried.
+    Locked rows are skipped, so that concurrent workers of the same teacher do not wait for each other.
+    """
+    with transaction.atomic():
+        entry = (
+            WaitlistEntry.objects.waiting().filter(teacher_id=teacher_id).select_for_update(skip_locked=True).first()
+        )
+        if entry is None:
+            return None
+        pk = (
+            MeetPlan.objects.filter(available_q(now), teacher_id=teacher_id)
+            .order_by("start_time", "id")
+            .select_for_update(skip_locked=True)
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if pk is None:
+            return None
+        if not MeetPlan.objects.book(pk, entry.student_id, entry.s_message, now):
+            return False
+        entry.meet_plan_id = pk
+        entry.save(update_fields=["meet_plan"])
+        # update() does not send post_save
+        MeetPlanStat.objects.update_counts([], MeetPlanStat.objects.get_plan_keys(pk=pk))
+        return True
+
+
+@shared_task
+def assign_waitlist(teacher_id):
+    """Assign the open plans of the teacher to the waitlist in FIFO order, returns the number of assigned plans."""
+    assigned = 0
+    while True:
+        result = assign_next(teacher_id, timezone.now())
+        if result is None:
+            break
+        assigned += result
+    if assigned:
+        # update() does not send post_save
+        invalidate_counts(MeetPlan)
+    return assigned
+
+
+@shared_task
+def assign_waitlists():
+    """Periodic sweep for plans freed without a signal, e.g. by ``update()``, see ``CELERY_BEAT_SCHEDULE``."""
+    teacher_ids = (
+        MeetPlan.objects.filter(
+            available_q(timezone.now()), teacher_id__in=WaitlistEntry.objects.waiting().values("teacher_id")
+        )
+        .order_by()
+        .values_list("teacher_id", flat=True)
+        .distinct()
+    )
+    for teacher_id in teacher_ids:
+        assign_waitlist.delay(teacher_id)
+
+
+@shared_task
+def count_booked_meet_plans(pks):
+    """Count the plans booked with ``MeetPlanQuerySet.book`` in ``MeetPlanStat``."""
+    with transaction.atomic():
+        MeetPlanStat.objects.update_counts([], MeetPlanStat.objects.get_plan_keys(pk__in=pks))
+
+
+@shared_task
+def rebuild_meet_plan_stats():
+    return MeetPlanStat.objects.rebuild()
@@ -0,0 +1,10 @@
+from django.utils import timezone
+
+
+def get_request_now(request):
+    """
+    The current time, evaluated once per request so that all rows of a response agree on it.
+    """
+    if not hasattr(request, "meet_plan_now"):
+        request.meet_plan_now = timezone.now()
+    return request.meet_plan_now
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -6,3 +7,9 @@ class OpenidClientConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.pku_auth"
     verbose_name = _("Openid Client")
+
+    def ready(self):
+        from apps.pku_auth.connection import invalidate_counts
+
+        post_save.connect(receiver=invalidate_counts, dispatch_uid="connection_count_save")
+        post_delete.connect(receiver=invalidate_counts, dispatch_uid="connection_count_delete")
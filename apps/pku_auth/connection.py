@@ -0,0 +1,140 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from graphene_django_plus.fields import CountableConnection as BaseCountableConnection
+
+from apps.meet_plan.utils import get_request_now
+
+COUNT_CACHE_PREFIX = "connection-count"
+
+
+def get_role(user):
+    if not user.is_authenticated:
+        return "anonymous"
+    if user.is_admin:
+        return "admin"
+    if user.is_teacher:
+        return "teacher"
+    return "student"
+
+
+def table_version_key(table):
+    return f"{COUNT_CACHE_PREFIX}:version:{table}"
+
+
+def get_table_versions(tables):
+    keys = [table_version_key(table) for table in tables]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate_counts(sender, **kwargs):
+    """Receiver of ``post_save`` and ``post_delete``, drops the cached counts of queries reading the table."""
+    try:
+        cache.incr(table_version_key(sender._meta.db_table))
+    except ValueError:
+        # no count depends on this table yet
+        pass
+
+
+def exact_count(queryset, info):
+    return queryset.count()
+
+
+def filters_on(node, value):
+    """Whether a lookup of the ``WHERE`` tree ``node`` compares with ``value``."""
+    if any(filters_on(child, value) for child in getattr(node, "children", ())):
+        return True
+    return getattr(node, "rhs", None) is value
+
+
+def cached_count(queryset, info):
+    """
+    Count cached per filter and role until a row of one of the queried tables is saved or deleted.
+
+    The key is built from the ``WHERE`` clause, which already contains the restrictions of
+    ``get_queryset`` for the requesting user. ``update()`` and ``bulk_create()`` do not send
+    signals, so such changes show up after ``CONNECTION_COUNT_CACHE_TIMEOUT`` at the latest.
+
+    Filters on the time of the request (``get_request_now``), e.g. ``meetPlans(available: true)``,
+    give another key at every request, they are counted without the cache.
+    """
+    query = queryset.order_by().values("pk").query
+    try:
+        sql, params = query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    if filters_on(query.where, get_request_now(info.context)):
+        return queryset.count()
+    tables = sorted({alias.table_name for alias in query.alias_map.values()})
+    filter_hash = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    versions = ".".join(str(version) for version in get_table_versions(tables))
+    key = f"{COUNT_CACHE_PREFIX}:{get_role(info.context.user)}:{versions}:{filter_hash}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout=settings.CONNECTION_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def table_estimate(model, using):
+    """Row count of the table estimated by the query planner, ``None`` if the database can not tell."""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        elif connection.vendor == "mysql":
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+                [model._meta.db_table],
+            )
+        else:
+            return None
+        row = cursor.fetchone()
+    # reltuples is -1 before the table has been analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def estimated_count(queryset, info):
+    """Planner estimate for unfiltered lists of admins, a cached count otherwise."""
+    if info.context.user.is_authenticated and info.context.user.is_admin and not queryset.query.where:
+        estimate = table_estimate(queryset.model, queryset.db)
+        if estimate is not None:
+            return estimate
+    return cached_count(queryset, info)
+
+
+COUNT_STRATEGIES = {
+    "exact": exact_count,
+    "cached": cached_count,
+    "estimate": estimated_count,
+}
+
+
+class CountableConnection(BaseCountableConnection):
+    """
+    Connection that provides a total_count attribute.
+
+    The count is only computed when ``totalCount`` is selected, with the ``count_strategy``
+    of the node type: ``"exact"`` (default), ``"cached"`` or ``"estimate"``, see ``COUNT_STRATEGIES``.
+    """
+
+    class Meta:
+        abstract = True
+
+    def resolve_total_count(root, info, **kwargs):
+        if hasattr(root, "length"):
+            return root.length
+
+        strategy = getattr(root._meta.node, "count_strategy", "exact")
+        return COUNT_STRATEGIES[strategy](root.iterable, info)
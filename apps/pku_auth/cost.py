@@ -0,0 +1,115 @@
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLObjectType,
+    InlineFragmentNode,
+    IntValueNode,
+    VariableNode,
+    get_named_type,
+    get_nullable_type,
+    get_operation_root_type,
+    is_composite_type,
+    is_list_type,
+)
+from graphql.validation import ValidationRule
+
+
+def is_connection(type_):
+    return isinstance(type_, GraphQLObjectType) and "edges" in type_.fields and "pageInfo" in type_.fields
+
+
+def is_edge(type_):
+    return isinstance(type_, GraphQLObjectType) and "node" in type_.fields and "cursor" in type_.fields
+
+
+def query_cost_rule(variables, operation_name, max_cost, max_depth, max_limit, list_size, report):
+    """
+    Validation rule rejecting the operation when its static cost is over ``max_cost`` or its depth
+    over ``max_depth``, the computed ``{"cost": ..., "depth": ...}`` is written into ``report``.
+
+    The cost is the number of objects the operation can return: a connection returns ``first``
+    (or ``last``) nodes, ``max_limit`` when neither is given, and everything selected on its nodes is
+    multiplied by that number; a list field, which has no limit, counts as ``list_size`` objects per
+    parent, and any other field of an object type as one. Scalars and introspection are free. The depth
+    is the number of nested fields, ``edges``, ``node`` and ``pageInfo`` of connections excluded.
+    The rule needs the variables, so it runs for each request.
+    """
+
+    class QueryCostRule(ValidationRule):
+        def enter_operation_definition(self, node, *_args):
+            if operation_name and (node.name is None or node.name.value != operation_name):
+                return self.SKIP
+            self.variables = {
+                definition.variable.name.value: definition.default_value.value
+                for definition in node.variable_definitions
+                if isinstance(definition.default_value, IntValueNode)
+            }
+            self.variables.update(variables or {})
+            root_type = get_operation_root_type(self.context.schema, node)
+            cost, depth = self.selection_cost(root_type, node.selection_set, 1, 0)
+            report.update(cost=cost, depth=depth)
+            if cost > max_cost:
+                self.report_error(GraphQLError(f"Query cost {cost} exceeds the maximum cost of {max_cost}.", node))
+            if depth > max_depth:
+                self.report_error(GraphQLError(f"Query depth {depth} exceeds the maximum depth of {max_depth}.", node))
+            return self.SKIP
+
+        def page_size(self, node):
+            arguments = {argument.name.value: argument.value for argument in node.arguments}
+            for name in ("first", "last"):
+                value = arguments.get(name)
+                if isinstance(value, VariableNode):
+                    value = self.variables.get(value.name.value)
+                elif isinstance(value, IntValueNode):
+                    value = value.value
+                try:
+                    return max(min(int(value), max_limit), 0)
+                except (TypeError, ValueError):
+                    continue
+            return max_limit
+
+        def selection_cost(self, parent_type, selection_set, multiplier, depth):
+            """The cost and the depth of ``selection_set`` on ``multiplier`` objects of ``parent_type``."""
+            cost, deepest = 0, depth
+            if selection_set is None:
+                return cost, deepest
+            for selection in selection_set.selections:
+                if isinstance(selection, FieldNode):
+                    name = selection.name.value
+                    fields = getattr(parent_type, "fields", {})
+                    if name.startswith("__") or name not in fields:
+                        continue
+                    type_ = get_named_type(fields[name].type)
+                    if is_connection(parent_type) or is_edge(parent_type):
+                        # the nodes of the connection have been counted on the connection field
+                        sub_cost, sub_depth = self.selection_cost(type_, selection.selection_set, multiplier, depth)
+                    elif is_composite_type(type_):
+                        if is_connection(type_):
+                            count = multiplier * self.page_size(selection)
+                        elif is_list_type(get_nullable_type(fields[name].type)):
+                            count = multiplier * list_size
+                        else:
+                            count = multiplier
+                        sub_cost, sub_depth = self.selection_cost(type_, selection.selection_set, count, depth + 1)
+                        sub_cost += count
+                    else:
+                        sub_cost, sub_depth = 0, depth + 1
+                elif isinstance(selection, InlineFragmentNode):
+                    type_ = parent_type
+                    if selection.type_condition is not None:
+                        type_ = self.context.schema.get_type(selection.type_condition.name.value)
+                    sub_cost, sub_depth = self.selection_cost(type_, selection.selection_set, multiplier, depth)
+                elif isinstance(selection, FragmentSpreadNode):
+                    fragment = self.context.get_fragment(selection.name.value)
+                    if fragment is None:
+                        continue
+                    type_ = self.context.schema.get_type(fragment.type_condition.name.value)
+                    sub_cost, sub_depth = self.selection_cost(type_, fragment.selection_set, multiplier, depth)
+                else:
+                    continue
+                cost += sub_cost
+                deepest = max(deepest, sub_depth)
+            return cost, deepest
+
+    return QueryCostRule
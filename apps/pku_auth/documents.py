@@ -0,0 +1,58 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from graphql import parse, validate
+
+
+def document_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class DocumentCache:
+    """
+    Per-process LRU of parsed and validated GraphQL documents, keyed by the sha256 of the query,
+    the same hash as the one of automatic persisted queries.
+
+    Only valid documents are kept, at most ``maxsize`` of them (``0`` disables the cache).
+    ``hits`` and ``misses`` count the lookups since the process started or the last ``clear()``.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, schema, query, key=None):
+        """
+        The document of ``query`` and its validation errors, ``key`` is its hash if already known.
+        Syntax errors are raised as ``GraphQLError``.
+        """
+        key = key or document_hash(query)
+        with self.lock:
+            document = self.documents.get(key)
+            if document is not None:
+                self.documents.move_to_end(key)
+                self.hits += 1
+                return document, []
+            self.misses += 1
+
+        document = parse(query)
+        errors = validate(schema, document)
+        if not errors and self.maxsize > 0:
+            with self.lock:
+                self.documents[key] = document
+                while len(self.documents) > self.maxsize:
+                    self.documents.popitem(last=False)
+        return document, errors
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.documents), "maxsize": self.maxsize}
@@ -0,0 +1,210 @@
+import json
+from collections import OrderedDict
+from functools import partial
+
+import graphene
+from django.core.exceptions import ValidationError
+from django.db.models import Manager, Q, QuerySet, Subquery
+from django.utils.translation import gettext as _
+from graphene.relay.connection import PageInfo
+from graphene.utils.thenables import maybe_thenable
+from graphene_django.filter import DjangoFilterConnectionField
+from graphql_relay import get_offset_with_default, offset_to_cursor
+from graphql_relay.utils import base64, unbase64
+
+from apps.pku_auth.optimizer import optimize_connection
+
+KEYSET_CURSOR_PREFIX = "keyset:"
+
+
+def keyset_cursor(obj):
+    # only the primary key, the values of the keyset fields may not be visible to the client
+    return base64(KEYSET_CURSOR_PREFIX + json.dumps(obj.pk))
+
+
+def keyset_values(cursor, model, fields):
+    """The values of ``fields`` of the row of ``cursor``, as subqueries of the page query looking the row up."""
+    try:
+        cursor = unbase64(cursor)
+        if not cursor.startswith(KEYSET_CURSOR_PREFIX):
+            raise ValueError
+        pk = model._meta.pk.to_python(json.loads(cursor.replace(KEYSET_CURSOR_PREFIX, "", 1)))
+        if isinstance(pk, (list, dict)):
+            raise ValueError
+    except (ValueError, TypeError, ValidationError):
+        raise ValidationError(_("Invalid cursor."))
+    row = model._default_manager.filter(pk=pk)
+    return [pk if field in ("pk", model._meta.pk.name) else Subquery(row.values(field)[:1]) for field in fields]
+
+
+def seek_q(fields, values, lookup):
+    """
+    ``(fields) > (values)`` for lookup ``gt`` (``<`` for ``lt``), written so that the index on
+    ``fields`` can be used: ``f0 >= v0 AND (f0 > v0 OR (f0 = v0 AND f1 > v1) OR ...)``.
+    """
+    condition = Q()
+    for i, field in enumerate(fields):
+        condition |= Q(**dict(zip(fields[:i], values[:i])), **{f"{field}__{lookup}": values[i]})
+    return Q(**{f"{fields[0]}__{lookup}e": values[0]}) & condition
+
+
+class FilterConnectionField(DjangoFilterConnectionField):
+    """
+    DjangoFilterConnectionField used by all our connections.
+
+    The queryset is optimized from the selection set, see ``apps.pku_auth.optimizer``.
+    Nested connections reuse the rows prefetched by the optimizer when they have no argument.
+
+    Once a page has been sliced, the nodes are handed to ``prime(info, instances)``
+    of the node type (if defined), so that related objects of the whole page can be
+    batched by the request loaders instead of being fetched edge by edge.
+
+    Nothing is counted while paginating: a page is fetched with one row more than requested to
+    know if there is a next page, ``totalCount`` is only computed when it is selected, see
+    ``apps.pku_auth.connection.CountableConnection``. Only ``last`` without ``before`` needs the count.
+
+    Node types defining ``keyset_fields`` get a ``keyset`` argument. With ``keyset: true``
+    the nodes are ordered by these fields and ``after`` / ``before`` become a ``WHERE (fields) > (values)``
+    seek instead of an offset, so a deep page costs as much as the first one and does not shift when
+    other rows change in between. Cursors only hold the primary key of their node, the values are read
+    from its row when seeking (a cursor of a deleted row is invalid), as they may be hidden from the client.
+    Fields created with ``keyset_only=True`` always paginate this way and have no ``keyset`` argument.
+    """
+
+    def __init__(self, *args, keyset_only=False, **kwargs):
+        self.keyset_only = keyset_only
+        super().__init__(*args, **kwargs)
+
+    @property
+    def args(self):
+        args = super().args
+        if getattr(self.node_type, "keyset_fields", None) and not self.keyset_only:
+            args = OrderedDict(args)
+            args["keyset"] = graphene.Argument(
+                graphene.Boolean,
+                default_value=False,
+                description="Paginate with keyset cursors, which stay stable when rows change between pages.",
+            )
+        return args
+
+    @args.setter
+    def args(self, args):
+        self._base_args = args
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        if isinstance(iterable, Manager) and not any(args.get(arg) is not None for arg in filtering_args):
+            queryset = iterable.get_queryset()
+            if queryset._result_cache is not None:
+                # prefetched by the optimizer, the node type's get_queryset has been applied already
+                return list(queryset)
+
+        queryset = super().resolve_queryset(connection, iterable, info, args, filtering_args, filterset_class)
+        return optimize_connection(queryset, info, connection._meta.node)
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        if isinstance(iterable, QuerySet):
+            if args.get("keyset"):
+                return cls.resolve_keyset_connection(connection, args, iterable, max_limit=max_limit)
+            if args.get("last") is None and args.get("before") is None:
+                return cls.resolve_offset_connection(connection, args, iterable, max_limit=max_limit)
+        return super().resolve_connection(connection, args, iterable, max_limit=max_limit)
+
+    @classmethod
+    def resolve_offset_connection(cls, connection, args, queryset, max_limit=None):
+        # same cursors as DjangoConnectionField.resolve_connection, without the count
+        start = get_offset_with_default(args.get("after"), -1) + 1
+        if args.get("offset"):
+            start += args["offset"]
+        first = args.get("first")
+        if first is None:
+            first = max_limit
+
+        if first is None:
+            nodes = list(queryset[start:])
+            has_next_page = False
+        else:
+            stop = start + first + 1
+            nodes = list(queryset[start:stop])
+            has_next_page = len(nodes) > first
+            nodes = nodes[:first]
+
+        edges = [connection.Edge(node=node, cursor=offset_to_cursor(start + i)) for i, node in enumerate(nodes)]
+        result = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=False,
+                has_next_page=has_next_page,
+            ),
+        )
+        result.iterable = queryset
+        return result
+
+    @classmethod
+    def resolve_keyset_connection(cls, connection, args, queryset, max_limit=None):
+        if args.get("offset") is not None:
+            raise ValidationError(_("Can not use offset with keyset pagination."))
+        model = queryset.model
+        fields = list(connection._meta.node.keyset_fields)
+        first, last = args.get("first"), args.get("last")
+        after, before = args.get("after"), args.get("before")
+
+        qs = queryset
+        if after:
+            qs = qs.filter(seek_q(fields, keyset_values(after, model, fields), "gt"))
+        if before:
+            qs = qs.filter(seek_q(fields, keyset_values(before, model, fields), "lt"))
+        backward = last is not None and first is None
+        if backward:
+            qs = qs.order_by(*[f"-{field}" for field in fields])
+        else:
+            qs = qs.order_by(*fields)
+
+        limit = last if backward else first
+        if limit is None:
+            limit = max_limit
+        if limit is None:
+            nodes = list(qs)
+            has_more = False
+        else:
+            nodes = list(qs[: limit + 1])
+            has_more = len(nodes) > limit
+            nodes = nodes[:limit]
+        if backward:
+            nodes.reverse()
+
+        edges = [connection.Edge(node=node, cursor=keyset_cursor(node)) for node in nodes]
+        result = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_more if backward else bool(after),
+                has_next_page=bool(before) if backward else has_more,
+            ),
+        )
+        result.iterable = queryset
+        return result
+
+    def wrap_resolve(self, parent_resolver):
+        resolver = super().wrap_resolve(parent_resolver)
+        if self.keyset_only:
+            return partial(resolver, keyset=True)
+        return resolver
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver, *args, **kwargs):
+        # the positional arguments end with ``root, info``, see DjangoConnectionField.wrap_resolve
+        info = args[-1]
+        result = super().connection_resolver(resolver, connection, default_manager, queryset_resolver, *args, **kwargs)
+        return maybe_thenable(result, lambda conn: cls.prime(conn, info))
+
+    @staticmethod
+    def prime(connection, info):
+        prime = getattr(connection._meta.node, "prime", None)
+        if prime is not None:
+            prime(info, [edge.node for edge in connection.edges])
+        return connection
@@ -0,0 +1,106 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from graphql import parse, validate
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.shortcuts import get_token
+
+from apps.meet_plan.models import MeetPlan
+from apps.pku_auth.documents import DocumentCache
+from apps.pku_auth.views import GraphQLView
+from apps.user.models import User
+from MeetPlan.schema import schema
+
+ME = """
+query {
+  me { id pk name email website phoneNumber address isTeacher isAdmin introduce department { id department } }
+}
+"""
+MEET_PLANS = """
+query($first: Int) {
+  meetPlans(first: $first) {
+    edges {
+      node { id pk place startTime duration tMessage available teacher { id name department { department } } }
+    }
+    pageInfo { hasNextPage endCursor }
+  }
+}
+"""
+OPERATIONS = {"me": (ME, {}), "meetPlans": (MEET_PLANS, {"first": 20})}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the me and meetPlans operations of /graphql/ with and without the cache of parsed "
+        "and validated documents. Sample rows are created in a transaction which is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plans", type=int, default=200, help="Number of sample meet plans.")
+        parser.add_argument("--repeat", type=int, default=200, help="Times each operation is executed.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            student = self.populate(options["plans"])
+            results = {}
+            for name, (query, variables) in OPERATIONS.items():
+                parse_latency = self.time(lambda: validate(schema.graphql_schema, parse(query)), options["repeat"])
+                uncached = self.run_operation(student, query, variables, 0, options["repeat"])
+                cached = self.run_operation(student, query, variables, 1, options["repeat"])
+                results[name] = (parse_latency, uncached, cached)
+            transaction.set_rollback(True)
+
+        for name, (parse_latency, uncached, cached) in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"  parse and validate: {parse_latency * 1000:.3f} ms")
+            for label, (latency, info) in (("uncached", uncached), ("cached", cached)):
+                self.stdout.write(
+                    f"  {label} request: {latency * 1000:.3f} ms, {info['hits']} hits, {info['misses']} misses"
+                )
+            self.stdout.write(f"  parse and validate share of an uncached request: {parse_latency / uncached[0]:.0%}")
+        self.stdout.write(self.style.SUCCESS("Benchmark finished, sample data has been rolled back."))
+
+    @staticmethod
+    def populate(plans):
+        teacher = User.objects.create(pku_id="9000000000", name="teacher", is_teacher=True)
+        student = User.objects.create(pku_id="8000000000", name="student")
+        start_time = timezone.now() + timedelta(days=1)
+        MeetPlan.objects.bulk_create(
+            [
+                MeetPlan(teacher=teacher, place="office", start_time=start_time + timedelta(minutes=30 * i))
+                for i in range(max(plans, 1))
+            ],
+            batch_size=5000,
+        )
+        return student
+
+    @staticmethod
+    def time(func, repeat):
+        latencies = []
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+        return statistics.median(latencies)
+
+    def run_operation(self, user, query, variables, maxsize, repeat):
+        view = GraphQLView.as_view()
+        body = json.dumps({"query": query, "variables": variables})
+        headers = {jwt_settings.JWT_AUTH_HEADER_NAME: f"{jwt_settings.JWT_AUTH_HEADER_PREFIX} {get_token(user)}"}
+        factory = RequestFactory()
+
+        def request():
+            response = view(factory.post("/graphql/", body, content_type="application/json", **headers))
+            assert response.status_code == 200, response.content
+
+        document_cache = DocumentCache(maxsize)
+        with mock.patch.object(GraphQLView, "document_cache", document_cache):
+            latency = self.time(request, repeat)
+        return latency, document_cache.info()
@@ -0,0 +1,197 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from guardian.models import UserObjectPermission
+
+from apps.pku_auth.connection import invalidate_counts
+from apps.user.models import Department, PkuIdSuffix, User
+from apps.user.search import index_users
+
+# columns which can be imported, besides pku_id and department
+USER_FIELDS = ["name", "email", "website", "phone_number", "address", "is_teacher", "introduce"]
+BOOLEAN_FIELDS = {"is_teacher"}
+TRUE_VALUES = {"1", "true", "t", "yes", "y"}
+PROGRESS = "{read} read, {created} created, {updated} updated, {unchanged} unchanged, {invalid} invalid"
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update users from a CSV file with a header line or a JSON lines file. "
+        "Records are matched by pku_id, the columns are "
+        f"pku_id, department (name), {', '.join(USER_FIELDS)}; missing columns are left unchanged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="The file to import.")
+        parser.add_argument(
+            "--format", choices=["csv", "jsonl"], help="Format of the file, guessed from its extension by default."
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Users written per query.")
+        parser.add_argument("--teacher", action="store_true", help="Import teachers when is_teacher is not given.")
+        parser.add_argument("--dry-run", action="store_true", help="Read and compare, but do not write anything.")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        file_format = options["format"] or path.suffix.lstrip(".").lower()
+        if file_format not in ("csv", "jsonl"):
+            raise CommandError(f"Unknown format of {path}, please pass --format.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size should be positive.")
+        self.teacher = options["teacher"]
+        self.dry_run = options["dry_run"]
+        # all departments in one query, new ones are added while importing
+        self.departments = dict(Department.objects.values_list("department", "pk"))
+        self.permission = Permission.objects.get(
+            content_type=ContentType.objects.get_for_model(User), codename="change_user"
+        )
+        self.totals = {"read": 0, "created": 0, "updated": 0, "unchanged": 0, "invalid": 0}
+
+        start = time.monotonic()
+        with path.open(encoding="utf-8-sig", newline="") as f:
+            records = enumerate(csv.DictReader(f), start=2) if file_format == "csv" else self.read_jsonl(f)
+            while True:
+                batch = list(islice(records, options["batch_size"]))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    self.import_batch(batch)
+                self.stdout.write(PROGRESS.format(**self.totals))
+
+        elapsed = time.monotonic() - start
+        rate = self.totals["read"] / elapsed if elapsed else 0
+        message = f"{self.totals['read']} users imported in {elapsed:.1f}s ({rate:.0f} users/s)."
+        if self.dry_run:
+            message += " Dry run, nothing has been written."
+        self.stdout.write(self.style.SUCCESS(message))
+
+    @staticmethod
+    def read_jsonl(f):
+        """The line numbers and records of the non-blank lines, the error of the lines which are no JSON."""
+        for number, line in enumerate(f, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, e
+
+    def clean_record(self, line, record):
+        """The pku_id and the field values of a record, ``None`` if it is invalid."""
+        if isinstance(record, ValueError):
+            self.stderr.write(f"line {line}: invalid JSON, {record}")
+            return None
+        if not isinstance(record, dict):
+            self.stderr.write(f"line {line}: {json.dumps(record, ensure_ascii=False)} is not an object")
+            return None
+        pku_id = str(record.get("pku_id") or "").strip()
+        try:
+            User.pku_id_validator(pku_id)
+        except ValidationError as e:
+            self.stderr.write(f"line {line}: {pku_id!r} is not a valid pku_id, {' '.join(e.messages)}")
+            return None
+
+        values = {}
+        for field in USER_FIELDS:
+            if field not in record:
+                continue
+            value = record[field]
+            if field in BOOLEAN_FIELDS:
+                value = value if isinstance(value, bool) else str(value or "").strip().lower() in TRUE_VALUES
+            else:
+                value = "" if value is None else str(value).strip()
+            values[field] = value
+        if "is_teacher" not in values and self.teacher:
+            values["is_teacher"] = True
+        if "department" in record:
+            values["department"] = str(record["department"] or "").strip()
+
+        # the checks of the model fields, blank values are allowed as they leave nothing to check
+        for field, value in values.items():
+            model_field = (Department if field == "department" else User)._meta.get_field(field)
+            try:
+                model_field.run_validators(model_field.to_python(value))
+            except ValidationError as e:
+                self.stderr.write(f"line {line}: {value!r} is not a valid {field}, {' '.join(e.messages)}")
+                return None
+        return pku_id, values
+
+    def create_departments(self, names):
+        """Add the departments which do not exist yet, with one insert and one select."""
+        missing = set(names) - self.departments.keys() - {""}
+        if missing and not self.dry_run:
+            Department.objects.bulk_create([Department(department=name) for name in missing], ignore_conflicts=True)
+            self.departments.update(Department.objects.filter(department__in=missing).values_list("department", "pk"))
+
+    def import_batch(self, batch):
+        self.totals["read"] += len(batch)
+
+        records = {}
+        for line, record in batch:
+            cleaned = self.clean_record(line, record)
+            if cleaned is None:
+                self.totals["invalid"] += 1
+                continue
+            pku_id, values = cleaned
+            # the last record of a pku_id wins
+            records.setdefault(pku_id, {}).update(values)
+
+        self.create_departments(values["department"] for values in records.values() if "department" in values)
+        for values in records.values():
+            if "department" in values:
+                name = values.pop("department")
+                values["department_id"] = self.departments.get(name) if name else None
+
+        existing = User.objects.in_bulk(records.keys(), field_name="pku_id")
+        created, updated, fields = [], [], set()
+        for pku_id, values in records.items():
+            user = existing.get(pku_id)
+            if user is None:
+                user = User(pku_id=pku_id, **values)
+                user.set_unusable_password()
+                created.append(user)
+                continue
+            changed = {field for field, value in values.items() if getattr(user, field) != value}
+            if changed:
+                for field in changed:
+                    setattr(user, field, values[field])
+                fields |= changed
+                updated.append(user)
+        self.totals["created"] += len(created)
+        self.totals["updated"] += len(updated)
+        self.totals["unchanged"] += len(records) - len(created) - len(updated)
+        if self.dry_run:
+            return
+
+        if created:
+            User.objects.bulk_create(created)
+            # bulk_create() does not return primary keys on every backend
+            users = list(User.objects.filter(pku_id__in=[user.pku_id for user in created]).values_list("pk", "pku_id"))
+            self.assign_change_perm([pk for pk, _pku_id in users])
+            PkuIdSuffix.objects.index(users)
+        if updated:
+            User.objects.bulk_update(updated, fields)
+        if created or updated:
+            # bulk_create() and bulk_update() do not send post_save
+            invalidate_counts(User)
+            index_users(User.objects.filter(pku_id__in=[user.pku_id for user in created + updated]))
+
+    def assign_change_perm(self, user_ids):
+        """The permission ``apps.user.signals.user_create_callback`` gives to users on their own profile."""
+        UserObjectPermission.objects.bulk_create(
+            [
+                UserObjectPermission(
+                    user_id=user_id,
+                    permission=self.permission,
+                    content_type=self.permission.content_type,
+                    object_pk=str(user_id),
+                )
+                for user_id in user_ids
+            ]
+        )
@@ -1,6 +1,7 @@
 import graphene
 from graphene import relay
-from graphene_django_plus.fields import CountableConnection
+
+from apps.pku_auth.connection import CountableConnection
 
 
 class AbstractMeta:
@@ -22,9 +23,10 @@ class AbstractMeta:
 
     ``AbstractMeta.connection_class``
 
-        *Default*: ``graphene_django_plus.fields.CountableConnection``
+        *Default*: ``apps.pku_auth.connection.CountableConnection``
 
-        Connection that provides a total_count attribute.
+        Connection that provides a total_count attribute, counted with the
+        ``count_strategy`` of the type.
 
     ``AbstractMeta.allow_unauthenticated``
 
@@ -0,0 +1,135 @@
+from django.db.models import Prefetch
+from graphene import Dynamic, List, NonNull
+from graphene.utils.str_converters import to_camel_case
+from graphene_django import DjangoObjectType
+from graphene_django.fields import DjangoConnectionField
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+class QueryOptimizer:
+    """
+    Reads the GraphQL selection set and applies ``only``, ``select_related`` and
+    ``prefetch_related`` to the queryset of a ``ModelType``.
+
+    Primary keys, foreign key columns and ``keyset_fields`` are always fetched. Resolvers which read other
+    model fields than their own name declare them on the type, e.g.::
+
+        class MeetPlanType(ModelType):
+            optimizer_hints = {"available": ["start_time"]}
+    """
+
+    def __init__(self, info):
+        self.info = info
+
+    def collect_fields(self, selection_sets, fields=None):
+        """Group the field nodes of the selection sets by field name, following fragments."""
+        fields = {} if fields is None else fields
+        for selection_set in selection_sets:
+            if selection_set is None:
+                continue
+            for selection in selection_set.selections:
+                if isinstance(selection, FieldNode):
+                    fields.setdefault(selection.name.value, []).append(selection)
+                elif isinstance(selection, InlineFragmentNode):
+                    self.collect_fields([selection.selection_set], fields)
+                elif isinstance(selection, FragmentSpreadNode):
+                    fragment = self.info.fragments.get(selection.name.value)
+                    if fragment is not None:
+                        self.collect_fields([fragment.selection_set], fields)
+        return fields
+
+    def node_selection_sets(self, field_nodes):
+        """Selection sets of ``edges { node { ... } }`` of connection field nodes."""
+        edges = self.collect_fields([node.selection_set for node in field_nodes]).get("edges", [])
+        nodes = self.collect_fields([edge.selection_set for edge in edges]).get("node", [])
+        return [node.selection_set for node in nodes]
+
+    def optimize(self, queryset, node_type, selection_sets):
+        only, select_related, prefetch_related = set(), set(), []
+        self.plan(node_type, selection_sets, "", only, select_related, prefetch_related)
+        queryset = queryset.only(*only)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def plan(self, node_type, selection_sets, prefix, only, select_related, prefetch_related):
+        model = node_type._meta.model
+        model_fields = {field.name: field for field in model._meta.concrete_fields}
+        model_fields.update({rel.get_accessor_name(): rel for rel in model._meta.related_objects})
+        graphene_fields = {to_camel_case(name): (name, field) for name, field in node_type._meta.fields.items()}
+        hints = getattr(node_type, "optimizer_hints", {})
+
+        only.add(prefix + model._meta.pk.name)
+        for field in model._meta.concrete_fields:
+            if field.is_relation:
+                only.add(prefix + field.name)
+        for name in getattr(node_type, "keyset_fields", ()):
+            only.add(prefix + name)
+
+        for ast_name, field_nodes in self.collect_fields(selection_sets).items():
+            if ast_name not in graphene_fields:
+                continue
+            name, graphene_field = graphene_fields[ast_name]
+            for hint in hints.get(name, []):
+                only.add(prefix + hint)
+
+            model_field = model_fields.get(name)
+            if model_field is None:
+                continue
+            if not model_field.is_relation:
+                only.add(prefix + name)
+                continue
+
+            related_type, is_connection = self.get_node_type(graphene_field)
+            if related_type is None:
+                continue
+            if model_field.many_to_one or model_field.one_to_one:
+                if model_field.concrete:
+                    select_related.add(prefix + name)
+                    sub_selection_sets = [node.selection_set for node in field_nodes]
+                    self.plan(
+                        related_type, sub_selection_sets, f"{prefix}{name}__", only, select_related, prefetch_related
+                    )
+            elif not prefix and self.can_prefetch(field_nodes):
+                if is_connection:
+                    sub_selection_sets = self.node_selection_sets(field_nodes)
+                else:
+                    sub_selection_sets = [node.selection_set for node in field_nodes]
+                queryset = related_type.get_queryset(related_type._meta.model._default_manager.all(), self.info)
+                queryset = self.optimize(queryset, related_type, sub_selection_sets)
+                prefetch_related.append(Prefetch(name, queryset=queryset))
+
+    @staticmethod
+    def get_node_type(graphene_field):
+        if isinstance(graphene_field, Dynamic):
+            graphene_field = graphene_field.get_type()
+        if graphene_field is None:
+            return None, False
+        if isinstance(graphene_field, DjangoConnectionField):
+            return graphene_field.node_type, True
+        _type = graphene_field.type
+        while isinstance(_type, (NonNull, List)):
+            _type = _type.of_type
+        if isinstance(_type, type) and issubclass(_type, DjangoObjectType):
+            return _type, False
+        return None, False
+
+    @staticmethod
+    def can_prefetch(field_nodes):
+        # nested connections with arguments are queried on their own: a prefetch has no LIMIT per parent,
+        # so a page of ``first`` nodes would be cut from all the related rows of every parent in Python
+        return len(field_nodes) == 1 and not field_nodes[0].arguments
+
+
+def optimize(queryset, info, node_type):
+    """Optimize the queryset of a field returning ``node_type`` objects."""
+    optimizer = QueryOptimizer(info)
+    return optimizer.optimize(queryset, node_type, [node.selection_set for node in info.field_nodes])
+
+
+def optimize_connection(queryset, info, node_type):
+    """Optimize the queryset of a connection field of ``node_type`` nodes."""
+    optimizer = QueryOptimizer(info)
+    return optimizer.optimize(queryset, node_type, optimizer.node_selection_sets(info.field_nodes))
@@ -3,6 +3,7 @@ from graphene_django_plus.types import ModelType
 
 from apps.pku_auth.meta import AbstractMeta, FieldWithDocs
 from apps.pku_auth.models import OpenIDClient
+from apps.pku_auth.optimizer import optimize
 
 
 class OpenIDClientType(ModelType):
@@ -23,10 +24,4 @@ class Query(graphene.ObjectType):
 
     @staticmethod
     def resolve_openid_client(root, info):
-        """
-        TODO: when https://github.com/tfoxy/graphene-django-optimizer release support graphene v3
-        try this
-        import graphene_django_optimizer as gql_optimizer
-        return gql_optimizer.query(OpenIDClient.objects.last(), info)
-        """
-        return OpenIDClient.objects.last()
+        return optimize(OpenIDClient.objects.all(), info, OpenIDClientType).last()
@@ -1,19 +1,26 @@
+import hashlib
 import json
 from datetime import timedelta
 from unittest import mock
+from urllib.parse import urlencode
 
-from django.test import TestCase, override_settings
+from django.core.cache import caches
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from freezegun import freeze_time
 from graphene_django.utils.testing import GraphQLTestCase
+from graphql import GraphQLError
 from graphql_jwt.settings import jwt_settings
 from graphql_jwt.shortcuts import get_token
 from graphql_jwt.utils import get_payload
 
 from apps.pku_auth.backends import OpenIDClientBackend
+from apps.pku_auth.documents import DocumentCache, document_hash
 from apps.pku_auth.models import OpenIDClient
+from apps.pku_auth.views import GraphQLView
 from apps.user.models import User, Department
+from MeetPlan.schema import schema
 
 
 class BackendTest(TestCase):
@@ -292,3 +299,250 @@ class ApiTestWithJWT(GraphQLTestCase):
             self.assertResponseHasErrors(response)
             self.assertIsNone(content["data"]["verifyToken"])
             self.assertEqual(content["errors"][0]["message"], _("Signature has expired"))
+
+
+class PersistedQueryTest(GraphQLTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(pku_id="2000000000", name="student")
+
+    def setUp(self):
+        caches["persisted_queries"].clear()
+        GraphQLView.document_cache.clear()
+
+    def post(self, sha256_hash, query=None, **extra):
+        body = {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": sha256_hash}}}
+        if query is not None:
+            body["query"] = query
+        headers = {jwt_settings.JWT_AUTH_HEADER_NAME: f"{jwt_settings.JWT_AUTH_HEADER_PREFIX} {get_token(self.user)}"}
+        body.update(extra)
+        return self.client.post(self.GRAPHQL_URL, json.dumps(body), content_type="application/json", **headers)
+
+    def test_persisted_query(self):
+        query = "query { me { name } }"
+        sha256_hash = hashlib.sha256(query.encode()).hexdigest()
+
+        response = self.post(sha256_hash)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND")
+
+        response = self.post(sha256_hash, query)
+        self.assertEqual(json.loads(response.content)["data"], {"me": {"name": "student"}})
+
+        with mock.patch("apps.pku_auth.documents.parse") as parse:
+            response = self.post(sha256_hash)
+        parse.assert_not_called()
+        self.assertEqual(json.loads(response.content)["data"], {"me": {"name": "student"}})
+
+        extensions = json.dumps({"persistedQuery": {"version": 1, "sha256Hash": sha256_hash}})
+        response = self.client.get(self.GRAPHQL_URL, {"extensions": extensions}, HTTP_ACCEPT="application/json")
+        self.assertEqual(json.loads(response.content)["data"], {"me": None})
+
+    def test_persisted_query_errors(self):
+        query = "query { me { name } }"
+        response = self.post("0" * 64, query)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(caches["persisted_queries"].get("0" * 64), None)
+
+        body = {"query": query, "extensions": {"persistedQuery": {"version": 2, "sha256Hash": "0" * 64}}}
+        response = self.client.post(self.GRAPHQL_URL, json.dumps(body), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+        # invalid documents are reported and not kept
+        query = "query { me { unknown } }"
+        sha256_hash = hashlib.sha256(query.encode()).hexdigest()
+        response = self.post(sha256_hash, query)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(sha256_hash, GraphQLView.document_cache.documents)
+
+
+class DocumentCacheTest(TestCase):
+    def setUp(self):
+        self.cache = DocumentCache(maxsize=2)
+
+    def test_document_cache(self):
+        queries = [f"query Q{i} {{ me {{ name }} }}" for i in range(3)]
+        for query in queries:
+            document, errors = self.cache.get(schema.graphql_schema, query)
+            self.assertEqual(errors, [])
+        self.assertEqual(self.cache.info(), {"hits": 0, "misses": 3, "size": 2, "maxsize": 2})
+        self.assertEqual(list(self.cache.documents), [document_hash(query) for query in queries[1:]])
+
+        with mock.patch("apps.pku_auth.documents.parse") as parse:
+            self.assertIs(self.cache.get(schema.graphql_schema, queries[2])[0], document)
+        parse.assert_not_called()
+        # the least recently used document goes first
+        self.cache.get(schema.graphql_schema, queries[1])
+        self.cache.get(schema.graphql_schema, queries[0])
+        self.assertEqual(list(self.cache.documents), [document_hash(query) for query in (queries[1], queries[0])])
+        self.assertEqual(self.cache.info(), {"hits": 2, "misses": 4, "size": 2, "maxsize": 2})
+
+    def test_document_cache_errors(self):
+        self.assertEqual(len(self.cache.get(schema.graphql_schema, "query { me { unknown } }")[1]), 1)
+        with self.assertRaises(GraphQLError):
+            self.cache.get(schema.graphql_schema, "query {")
+        self.assertEqual(self.cache.info(), {"hits": 0, "misses": 2, "size": 0, "maxsize": 2})
+
+        cache = DocumentCache(maxsize=0)
+        cache.get(schema.graphql_schema, "query { me { name } }")
+        self.assertEqual(cache.info()["size"], 0)
+
+
+class QueryCostTest(GraphQLTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(pku_id="2000000000", name="student")
+
+    def cost(self, query, variables=None, status_code=200):
+        headers = {jwt_settings.JWT_AUTH_HEADER_NAME: f"{jwt_settings.JWT_AUTH_HEADER_PREFIX} {get_token(self.user)}"}
+        response = self.query(query, variables=variables, headers=headers)
+        self.assertEqual(response.status_code, status_code)
+        content = json.loads(response.content)
+        return content["extensions"]["cost"], content.get("errors")
+
+    def test_query_cost(self):
+        cost, errors = self.cost("query { me { name department { department } } }")
+        self.assertEqual(cost, {"cost": 2, "depth": 3, "maxCost": 50000})
+
+        query = """
+        query($first: Int) {
+          meetPlans(first: $first) {
+            totalCount
+            pageInfo { hasNextPage }
+            edges { cursor node { place teacher { ...teacher } } }
+          }
+        }
+        fragment teacher on UserType { name department { department } }
+        """
+        self.assertEqual(self.cost(query, {"first": 20})[0]["cost"], 60)
+        self.assertEqual(self.cost(query, {"first": 1000})[0]["cost"], 300)
+        cost, errors = self.cost(query)
+        self.assertEqual(cost, {"cost": 300, "depth": 4, "maxCost": 50000})
+        self.assertIsNone(errors)
+
+    def test_query_cost_list(self):
+        # list fields have no page size, each counts as GRAPHQL_LIST_SIZE objects
+        self.assertEqual(self.cost("query { termDates { startDate } }")[0]["cost"], 100)
+        query = "query { meetPlanStats(groupBy: TEACHER) { teacher { name department { department } } } }"
+        self.assertEqual(self.cost(query)[0]["cost"], 300)
+        with override_settings(GRAPHQL_LIST_SIZE=10):
+            self.assertEqual(self.cost(query)[0]["cost"], 30)
+            query = "query { departments(first: 5) { edges { node { userSet { edges { node { name } } } } } } }"
+            self.assertEqual(self.cost(query)[0]["cost"], 505)
+
+    def test_query_cost_exceeded(self):
+        query = """
+        query {
+          departments {
+            edges { node { userSet { edges { node { department { userSet { edges { node { name } } } } } } } } }
+          }
+        }
+        """
+        cost, errors = self.cost(query, status_code=400)
+        self.assertEqual(cost["cost"], 1020100)
+        self.assertEqual(errors[0]["message"], "Query cost 1020100 exceeds the maximum cost of 50000.")
+
+        with override_settings(GRAPHQL_MAX_QUERY_DEPTH=4):
+            cost, errors = self.cost(query, status_code=400)
+        self.assertEqual([error["message"] for error in errors][1], "Query depth 5 exceeds the maximum depth of 4.")
+
+
+class ResponseCacheTest(GraphQLTestCase):
+    QUERY = """
+    query {
+      termDate { startDate }
+      departments { edges { node { department } } }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(pku_id="2000000000", name="student")
+        cls.department = Department.objects.create(department="physics")
+
+    def departments(self, query=QUERY, **kwargs):
+        response = self.query(query, **kwargs)
+        self.assertResponseNoErrors(response)
+        return [edge["node"]["department"] for edge in json.loads(response.content)["data"]["departments"]["edges"]]
+
+    def test_anonymous_response_cache(self):
+        self.assertEqual(self.departments(), ["physics"])
+        # the same query written differently
+        with self.assertNumQueries(0):
+            self.assertEqual(self.departments(" ".join(self.QUERY.split())), ["physics"])
+
+        Department.objects.create(department="chemistry")
+        self.assertEqual(self.departments(), ["physics", "chemistry"])
+        self.department.department = "biology"
+        self.department.save()
+        self.assertEqual(self.departments(), ["biology", "chemistry"])
+
+    def test_response_cache_not_used(self):
+        self.departments()
+        Department.objects.filter(pk=self.department.pk).update(department="biology")
+        headers = {jwt_settings.JWT_AUTH_HEADER_NAME: f"{jwt_settings.JWT_AUTH_HEADER_PREFIX} {get_token(self.user)}"}
+        self.assertEqual(self.departments(headers=headers), ["biology"])
+        # the user is not among the cached fields
+        query = "query { me { name } departments { edges { node { department } } } }"
+        self.assertEqual(self.departments(query), ["biology"])
+        # variables are part of the key
+        query = """
+        query($department: String) {
+          departments(department_Icontains: $department) { edges { node { department } } }
+        }
+        """
+        self.assertEqual(self.departments(query, variables={"department": "bio"}), ["biology"])
+        self.assertEqual(self.departments(query, variables={"department": "phys"}), [])
+
+    def test_request_without_user(self):
+        # built by RequestFactory like in manage.py benchmarkdocuments, without the middlewares
+        view = GraphQLView.as_view()
+        headers = {jwt_settings.JWT_AUTH_HEADER_NAME: f"{jwt_settings.JWT_AUTH_HEADER_PREFIX} {get_token(self.user)}"}
+        body = json.dumps({"query": "query { me { name } }"})
+        response = view(RequestFactory().post("/graphql/", body, content_type="application/json", **headers))
+        self.assertEqual(json.loads(response.content), {"data": {"me": {"name": "student"}}, "extensions": mock.ANY})
+        body = json.dumps({"query": self.QUERY})
+        response = view(RequestFactory().post("/graphql/", body, content_type="application/json", **headers))
+        self.assertEqual(
+            json.loads(response.content)["data"]["departments"]["edges"][0]["node"]["department"], "physics"
+        )
+
+
+class ConditionalGetTest(GraphQLTestCase):
+    QUERY = "query { departments { edges { node { department } } } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(department="physics")
+
+    def get(self, **headers):
+        return self.client.get(self.GRAPHQL_URL, {"query": self.QUERY}, HTTP_ACCEPT="application/json", **headers)
+
+    def test_etag(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        Department.objects.create(department="chemistry")
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        response = self.client.post(self.GRAPHQL_URL, {"query": self.QUERY}, content_type="application/json")
+        self.assertFalse(response.has_header("ETag"))
+
+    async def test_etag_asgi(self):
+        client = AsyncClient()
+        path = f"{self.GRAPHQL_URL}?{urlencode({'query': self.QUERY})}"
+        # the extra arguments of AsyncClient are the header names
+        response = await client.get(path, accept="application/json")
+        self.assertEqual(response.status_code, 200)
+        response = await client.get(path, **{"accept": "application/json", "if-none-match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
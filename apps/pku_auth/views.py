@@ -0,0 +1,267 @@
+import json
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connection, transaction
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, set_response_etag
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
+from graphql import (
+    ExecutionResult,
+    FieldNode,
+    GraphQLError,
+    OperationType,
+    execute_sync,
+    get_operation_ast,
+    print_ast,
+    validate,
+)
+from graphql_jwt.settings import jwt_settings
+
+from apps.pku_auth.connection import get_table_versions
+from apps.pku_auth.cost import query_cost_rule
+from apps.pku_auth.documents import DocumentCache, document_hash
+
+PERSISTED_QUERY_VERSION = 1
+RESPONSE_CACHE_PREFIX = "anonymous-response"
+
+
+class PersistedQueryNotFound(Exception):
+    """The hash of a persisted query is unknown, the client sends the query along with it again."""
+
+    def __str__(self):
+        return "PersistedQueryNotFound"
+
+
+class GraphQLView(BaseGraphQLView):
+    """
+    GraphQLView of the ``/graphql/`` endpoint, with automatic persisted queries.
+
+    A client sends ``extensions: {"persistedQuery": {"version": 1, "sha256Hash": ...}}`` without the
+    query. If the hash is unknown the response is a ``PERSISTED_QUERY_NOT_FOUND`` error, and the client
+    repeats the request with the query, which is then stored in the ``PERSISTED_QUERIES_CACHE`` under
+    its hash. The extensions can be sent as JSON in the body or in the ``extensions`` parameter of a GET.
+
+    Documents are parsed and validated once per process and kept in ``document_cache``,
+    an LRU of ``GRAPHQL_DOCUMENT_CACHE_SIZE`` documents, so repeated queries are only executed.
+
+    Operations costing more than ``GRAPHQL_MAX_QUERY_COST`` or nested deeper than ``GRAPHQL_MAX_QUERY_DEPTH``
+    are rejected, the cost is reported in the ``extensions`` of the response, see ``apps.pku_auth.cost``.
+
+    Responses to anonymous queries of public fields are cached, see ``get_response_cache_key``.
+
+    Query responses to GET requests have a strong ``ETag`` computed from their body and are answered
+    with ``304 Not Modified`` when it matches the ``If-None-Match`` header of the request.
+    """
+
+    document_cache = DocumentCache(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if request.method == "GET" and response.status_code == 200 and response["Content-Type"] == "application/json":
+            # polling clients revalidate and get 304 Not Modified while the response does not change
+            patch_vary_headers(response, ["Authorization"])
+            patch_cache_control(response, private=True, no_cache=True)
+            set_response_etag(response)
+            response = get_conditional_response(request, etag=response["ETag"], response=response)
+        return response
+
+    def get_response(self, request, data, show_graphiql=False):
+        # same as GraphQLView.get_response, with the extensions of the result
+        try:
+            query, variables, operation_name, id = self.get_graphql_params(request, data)
+        except PersistedQueryNotFound as e:
+            error = {"message": str(e), "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}
+            return self.json_encode(request, {"errors": [error]}), 200
+
+        cache_key = None
+        if not self.batch and not show_graphiql and not request.GET.get("pretty"):
+            cache_key = self.get_response_cache_key(request, data, query, variables, operation_name)
+            if cache_key is not None:
+                result = cache.get(cache_key)
+                if result is not None:
+                    return result, 200
+
+        execution_result = self.execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        if not execution_result:
+            return None, 200
+
+        status_code = 200
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.errors and any(not getattr(e, "path", None) for e in execution_result.errors):
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+        if execution_result.extensions:
+            response["extensions"] = execution_result.extensions
+        if self.batch:
+            response["id"] = id
+            response["status"] = status_code
+        result = self.json_encode(request, response, pretty=show_graphiql)
+        if cache_key is not None and not execution_result.errors:
+            cache.set(cache_key, result, timeout=settings.ANONYMOUS_RESPONSE_CACHE_TIMEOUT)
+        return result, status_code
+
+    def get_response_cache_key(self, request, data, query, variables, operation_name):
+        """
+        Cache key of the response to an anonymous query which only selects root fields of
+        ``ANONYMOUS_RESPONSE_CACHE_FIELDS``, ``None`` if the response can not be cached.
+
+        The key contains the versions of the tables of these fields, which change whenever a row is
+        saved or deleted (see ``apps.pku_auth.connection.invalidate_counts``), so a hit is served
+        without a single query.
+        """
+        if not query:
+            return None
+        if jwt_settings.JWT_AUTH_HEADER_NAME in request.META or jwt_settings.JWT_COOKIE_NAME in request.COOKIES:
+            return None
+        # requests built without the middlewares, e.g. by RequestFactory, have no user
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return None
+        try:
+            document, errors = self.get_document(request, data, query)
+        except GraphQLError:
+            return None
+        operation_ast = get_operation_ast(document, operation_name)
+        if errors or operation_ast is None or operation_ast.operation != OperationType.QUERY:
+            return None
+
+        cached_fields = settings.ANONYMOUS_RESPONSE_CACHE_FIELDS
+        models = set()
+        for selection in operation_ast.selection_set.selections:
+            if not isinstance(selection, FieldNode) or selection.name.value not in cached_fields:
+                return None
+            models.update(cached_fields[selection.name.value])
+        tables = sorted(apps.get_model(model)._meta.db_table for model in models)
+        versions = ".".join(str(version) for version in get_table_versions(tables))
+        normalized = json.dumps([print_ast(document), variables, operation_name], sort_keys=True)
+        return f"{RESPONSE_CACHE_PREFIX}:{versions}:{document_hash(normalized)}"
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        sha256_hash = self.get_persisted_query_hash(request, data)
+        if sha256_hash is not None:
+            query = self.get_persisted_query(sha256_hash, query)
+        return query, variables, operation_name, id
+
+    @staticmethod
+    def get_persisted_query_hash(request, data):
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if not extensions:
+            return None
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        persisted_query = extensions.get("persistedQuery") if isinstance(extensions, dict) else None
+        if not persisted_query:
+            return None
+        if persisted_query.get("version") != PERSISTED_QUERY_VERSION:
+            raise HttpError(HttpResponseBadRequest("Unsupported persisted query version."))
+        sha256_hash = persisted_query.get("sha256Hash")
+        if not isinstance(sha256_hash, str) or not sha256_hash:
+            raise HttpError(HttpResponseBadRequest("Persisted query without sha256Hash."))
+        return sha256_hash.lower()
+
+    @staticmethod
+    def get_persisted_query(sha256_hash, query):
+        """The query stored under ``sha256_hash``, stores ``query`` when it is given."""
+        store = caches[settings.PERSISTED_QUERIES_CACHE]
+        if not query:
+            query = store.get(sha256_hash)
+            if query is None:
+                raise PersistedQueryNotFound
+            return query
+        if document_hash(query) != sha256_hash:
+            raise HttpError(HttpResponseBadRequest("The sha256Hash does not match the query."))
+        store.set(sha256_hash, query)
+        return query
+
+    def get_document(self, request, data, query):
+        """The parsed document of ``query`` and its validation errors."""
+        # the hash of a persisted query has been checked against the query when it was stored
+        sha256_hash = self.get_persisted_query_hash(request, data)
+        return self.document_cache.get(self.schema.graphql_schema, query, key=sha256_hash)
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        # same as GraphQLView.execute_graphql_request, the document is only parsed and validated once
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        try:
+            document, validation_errors = self.get_document(request, data, query)
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if request.method.lower() == "get" and operation_ast and operation_ast.operation != OperationType.QUERY:
+            if show_graphiql:
+                return None
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"], f"Can only perform a {operation_ast.operation.value} operation from a POST request."
+                )
+            )
+
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        cost = {}
+        rule = query_cost_rule(
+            variables,
+            operation_name,
+            settings.GRAPHQL_MAX_QUERY_COST,
+            settings.GRAPHQL_MAX_QUERY_DEPTH,
+            graphene_settings.RELAY_CONNECTION_MAX_LIMIT,
+            settings.GRAPHQL_LIST_SIZE,
+            cost,
+        )
+        cost_errors = validate(self.schema.graphql_schema, document, [rule])
+        extensions = {"cost": {**cost, "maxCost": settings.GRAPHQL_MAX_QUERY_COST}} if cost else None
+        if cost_errors:
+            return ExecutionResult(data=None, errors=cost_errors, extensions=extensions)
+
+        try:
+            options = {
+                "schema": self.schema.graphql_schema,
+                "document": document,
+                "root_value": self.get_root_value(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "context_value": self.get_context(request),
+                "middleware": self.get_middleware(request),
+                "execution_context_class": self.execution_context_class,
+            }
+            if (
+                operation_ast
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute_sync(**options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+            else:
+                result = execute_sync(**options)
+        except Exception as e:
+            return ExecutionResult(errors=[e], extensions=extensions)
+        result.extensions = extensions
+        return result
@@ -5,10 +5,12 @@ from django.contrib.auth.forms import (
     UsernameField,
     UserChangeForm as BaseUserChangeForm,
 )
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from guardian.admin import GuardedModelAdminMixin
 
-from apps.user.models import Department, User
+from apps.user.models import Department, User, pku_id_q
+from apps.user.search import search_filter
 
 
 @admin.register(Department)
@@ -81,7 +83,17 @@ class UserAdmin(GuardedModelAdminMixin, BaseUserAdmin):
         "groups",
         "department",
     )
-    search_fields = ("pku_id", "name", "email", "introduce")
+    # pku_id is looked up in its suffixes, name, department and introduce in the full-text index
+    search_fields = ("email",)
     ordering = ("pku_id",)
     add_form = UserCreationForm
     form = UserChangeForm
+
+    def get_search_results(self, request, queryset, search_term):
+        results, use_distinct = super().get_search_results(request, queryset, search_term)
+        if search_term.strip():
+            pku_id = Q()
+            for term in search_term.split():
+                pku_id &= pku_id_q("pku_id", "contains", term)
+            results |= queryset.filter(pku_id) | queryset.filter(search_filter(search_term, using=queryset.db))
+        return results, use_distinct
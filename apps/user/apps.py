@@ -1,9 +1,7 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.utils.translation import gettext_lazy as _
 
-from apps.pku_auth.signals import user_create
-from apps.user.signals import user_create_callback
-
 
 class UserConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
@@ -11,4 +9,24 @@ class UserConfig(AppConfig):
     verbose_name = _("User management")
 
     def ready(self):
+        from apps.pku_auth.signals import user_create
+        from apps.user.models import Department, User
+        from apps.user.search import create_search_index
+        from apps.user.signals import (
+            create_pku_id_suffixes,
+            department_search_post_save,
+            user_create_callback,
+            user_pku_id_post_save,
+            user_search_post_delete,
+            user_search_post_save,
+        )
+
         user_create.connect(receiver=user_create_callback, dispatch_uid="openid_auth_create_user")
+        post_migrate.connect(receiver=create_search_index, dispatch_uid="user_search_create")
+        post_migrate.connect(receiver=create_pku_id_suffixes, sender=self, dispatch_uid="user_pku_id_create")
+        post_save.connect(receiver=user_pku_id_post_save, sender=User, dispatch_uid="user_pku_id_save")
+        post_save.connect(receiver=user_search_post_save, sender=User, dispatch_uid="user_search_save")
+        post_delete.connect(receiver=user_search_post_delete, sender=User, dispatch_uid="user_search_delete")
+        post_save.connect(
+            receiver=department_search_post_save, sender=Department, dispatch_uid="department_search_save"
+        )
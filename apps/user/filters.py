@@ -0,0 +1,40 @@
+from django_filters import CharFilter, FilterSet
+from django_filters.constants import EMPTY_VALUES
+
+from apps.user.models import User, pku_id_q
+from apps.user.search import search_users
+
+
+class PkuIdFilter(CharFilter):
+    """``contains`` and ``startswith`` filters of a pku_id field which use its indexes, see ``pku_id_q``."""
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return qs.filter(pku_id_q(self.field_name, self.lookup_expr, value))
+
+
+class UserFilter(FilterSet):
+    """
+    ``search`` looks the words up in the full-text index of ``apps.user.search`` and orders
+    the users by relevance, unless they are paginated with ``keyset``.
+    """
+
+    search = CharFilter(method="filter_search")
+    pku_id__contains = PkuIdFilter(field_name="pku_id", lookup_expr="contains")
+    pku_id__startswith = PkuIdFilter(field_name="pku_id", lookup_expr="startswith")
+
+    class Meta:
+        model = User
+        fields = {
+            "pku_id": ["exact"],
+            "name": ["icontains"],
+            "department__id": ["exact", "in"],
+            "department__department": ["icontains"],
+            "is_teacher": ["exact"],
+            "is_admin": ["exact"],
+            "is_active": ["exact"],
+        }
+
+    def filter_search(self, queryset, name, value):
+        return search_users(queryset, value)
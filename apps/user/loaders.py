@@ -0,0 +1,90 @@
+from apps.user.models import Department, User
+
+
+class DataLoader:
+    """
+    A request scoped loader which batches lookups by primary key.
+
+    Keys are collected with ``queue`` (usually for a whole page of a connection)
+    and all queued keys are fetched with one query when the first of them is loaded.
+    Loaded objects are cached until the end of the request.
+    """
+
+    model = None
+
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self._cache = {}
+        self._queue = set()
+
+    def get_queryset(self, keys):
+        return self.model._default_manager.filter(pk__in=keys)
+
+    def batch_load(self, keys):
+        return {obj.pk: obj for obj in self.get_queryset(keys)}
+
+    def queue(self, keys):
+        self._queue.update(key for key in keys if key is not None and key not in self._cache)
+
+    def prime(self, key, value):
+        self._cache.setdefault(key, value)
+
+    def load(self, key):
+        if key is None:
+            return None
+        if key not in self._cache:
+            keys, self._queue = self._queue | {key}, set()
+            objs = self.batch_load(keys)
+            for k in keys:
+                self._cache[k] = objs.get(k)
+        return self._cache[key]
+
+
+class UserLoader(DataLoader):
+    model = User
+
+    def batch_load(self, keys):
+        objs = super().batch_load(keys)
+        self.loaders.department.queue(obj.department_id for obj in objs.values())
+        return objs
+
+
+class DepartmentLoader(DataLoader):
+    model = Department
+
+
+class Loaders:
+    def __init__(self):
+        self.user = UserLoader(self)
+        self.department = DepartmentLoader(self)
+
+
+def get_loaders(info):
+    context = info.context
+    if not hasattr(context, "loaders"):
+        context.loaders = Loaders()
+    return context.loaders
+
+
+def queue_related(info, instances, field_name, loader_name):
+    """Queue the foreign key ``field_name`` of ``instances`` which has not been fetched with ``select_related``."""
+    if not instances:
+        return
+    field = instances[0]._meta.get_field(field_name)
+    getattr(get_loaders(info), loader_name).queue(
+        getattr(instance, field.attname) for instance in instances if not field.is_cached(instance)
+    )
+
+
+def load_related(info, instance, field_name, loader_name):
+    """
+    Resolve the foreign key ``field_name`` of ``instance``.
+    Objects already fetched with ``select_related`` are returned as is, others go through the loader.
+    """
+    field = instance._meta.get_field(field_name)
+    if field.is_cached(instance):
+        return field.get_cached_value(instance)
+    obj = getattr(get_loaders(info), loader_name).load(getattr(instance, field.attname))
+    if obj is not None:
+        field.set_cached_value(instance, obj)
+    return obj
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from apps.user.models import PkuIdSuffix
+from apps.user.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the full-text index of the users again and fill it, "
+        "together with the pku_id suffixes, from the user table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS, help="Database to rebuild the index of.")
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        with transaction.atomic(using=using):
+            users = rebuild_search_index(using)
+            PkuIdSuffix.objects.db_manager(using).rebuild()
+        self.stdout.write(self.style.SUCCESS(f"{users} users indexed."))
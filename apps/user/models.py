@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from guardian.mixins import GuardianUserMixin
 
@@ -67,6 +68,13 @@ class User(AbstractUser, GuardianUserMixin):
     class Meta(AbstractUser.Meta):
         abstract = False
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the stored pku_id, its suffixes are only indexed again when it changes
+        instance._loaded_pku_id = instance.__dict__.get("pku_id")
+        return instance
+
     @property
     def is_staff(self):
         return self.is_superuser
@@ -76,3 +84,73 @@ class User(AbstractUser, GuardianUserMixin):
 
     def get_short_name(self):
         return self.name
+
+
+# shorter values match most of the users, a scan stops sooner on the first page than the index lookup
+PKU_ID_SUFFIX_MIN_LENGTH = 3
+
+
+def next_prefix(prefix):
+    """The smallest string greater than all strings starting with ``prefix``."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def pku_id_q(field_name, lookup, value):
+    """
+    ``Q`` of ``<field_name>__<lookup>`` for the ``startswith`` and ``contains`` lookups of pku_id,
+    as range scans of indexes instead of ``LIKE``: ``startswith`` is a range of the unique index
+    of pku_id, ``contains`` of at least ``PKU_ID_SUFFIX_MIN_LENGTH`` characters a range of the
+    suffixes of ``PkuIdSuffix``.
+    """
+    if not value:
+        return Q()
+    if lookup == "startswith":
+        return Q(**{f"{field_name}__gte": value, f"{field_name}__lt": next_prefix(value)})
+    if lookup == "contains" and len(value) >= PKU_ID_SUFFIX_MIN_LENGTH:
+        # ``value`` is contained in a pku_id if it starts one of its suffixes
+        prefix = field_name[: -len("pku_id")]
+        user_ids = PkuIdSuffix.objects.filter(suffix__gte=value, suffix__lt=next_prefix(value)).values("user_id")
+        return Q(**{f"{prefix}pk__in": user_ids})
+    return Q(**{f"{field_name}__{lookup}": value})
+
+
+class PkuIdSuffixManager(models.Manager):
+    def index(self, users):
+        """Replace the suffixes of ``users``, a list of ``(pk, pku_id)`` pairs."""
+        users = list(users)
+        if not users:
+            return
+        self.filter(user_id__in=[pk for pk, _pku_id in users]).delete()
+        self.bulk_create(
+            [self.model(user_id=pk, suffix=pku_id[i:]) for pk, pku_id in users if pku_id for i in range(len(pku_id))],
+            batch_size=5000,
+        )
+
+    def index_missing(self):
+        """Index the users without suffixes, return how many there were."""
+        users = list(
+            User._default_manager.using(self.db).filter(pku_id_suffixes__isnull=True).values_list("pk", "pku_id")
+        )
+        self.index(users)
+        return len(users)
+
+    def rebuild(self):
+        self.all().delete()
+        return self.index_missing()
+
+
+class PkuIdSuffix(models.Model):
+    """
+    Every suffix of the pku_id of a user, so that a ``contains`` search of a partial pku_id
+    is a range scan of the suffix index, see ``pku_id_q``.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="pku_id_suffixes")
+    suffix = models.CharField(max_length=10)
+
+    objects = PkuIdSuffixManager()
+
+    class Meta:
+        verbose_name = _("pku id suffix")
+        verbose_name_plural = _("pku id suffixes")
+        indexes = [models.Index(fields=["suffix", "user"], name="pkuidsuffix_suffix_user_idx")]
@@ -1,11 +1,13 @@
 import graphene
 from django.utils.translation import gettext_lazy as _
 from graphene import relay
-from graphene_django.filter import DjangoFilterConnectionField
 from graphene_django_plus.types import ModelType
 from graphql_jwt.exceptions import PermissionDenied
 
+from apps.pku_auth.fields import FilterConnectionField
 from apps.pku_auth.meta import AbstractMeta, PKTypeMixin
+from apps.user.filters import UserFilter
+from apps.user.loaders import load_related, queue_related
 from apps.user.models import User, Department
 
 
@@ -16,6 +18,8 @@ class DepartmentType(PKTypeMixin, ModelType):
         filter_fields = {"id": ["exact", "in"], "department": ["icontains"]}
         allow_unauthenticated = True
 
+    user_set = FilterConnectionField(lambda: UserType, required=True)
+
 
 class UserType(PKTypeMixin, ModelType):
     class Meta(AbstractMeta):
@@ -37,15 +41,17 @@ class UserType(PKTypeMixin, ModelType):
             # 'date_joined',
             # 'last_login',
         ]
-        filter_fields = {
-            "pku_id": ["exact", "contains", "startswith"],
-            "name": ["icontains"],
-            "department__id": ["exact", "in"],
-            "department__department": ["icontains"],
-            "is_teacher": ["exact"],
-            "is_admin": ["exact"],
-            "is_active": ["exact"],
-        }
+        filterset_class = UserFilter
+
+    optimizer_hints = {"pku_id": ["pku_id", "is_teacher"]}
+    keyset_fields = ("pku_id",)
+    count_strategy = "estimate"
+
+    department = graphene.Field(DepartmentType)
+
+    @staticmethod
+    def resolve_department(parent, info):
+        return load_related(info, parent, "department", "department")
 
     pku_id = graphene.String(description=_("Only allow user query himself or teacher query student on this field."))
 
@@ -96,6 +102,10 @@ class UserType(PKTypeMixin, ModelType):
             return super().get_queryset(qs, info)
         return User.objects.none()
 
+    @classmethod
+    def prime(cls, info, instances):
+        queue_related(info, instances, "department", "department")
+
 
 class Query(graphene.ObjectType):
     me = graphene.Field(UserType)
@@ -107,7 +117,7 @@ class Query(graphene.ObjectType):
         return None
 
     department = relay.Node.Field(DepartmentType)
-    departments = DjangoFilterConnectionField(DepartmentType)
+    departments = FilterConnectionField(DepartmentType)
 
     user = relay.Node.Field(UserType)
-    users = DjangoFilterConnectionField(UserType)
+    users = FilterConnectionField(UserType)
@@ -0,0 +1,264 @@
+"""
+Full-text index of the users on their name, department and introduction.
+
+The index lives in its own table next to ``user_user``, created after ``migrate`` and kept up to
+date by the signals of ``apps.user.signals``: an FTS5 virtual table with the trigram tokenizer on
+SQLite, a table with a ``pg_trgm`` GIN index on PostgreSQL. Every word of a search is matched
+anywhere in the texts, as Chinese has no spaces between words: ``三`` finds ``张三`` and ``物理``
+finds ``我研究凝聚态物理``; all the words have to match. Trigrams only index words of 3 characters or
+more, shorter ones are ``LIKE`` lookups on the index table. Other databases have no index and fall
+back to ``icontains`` lookups, without ranking.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from apps.user.models import Department, User
+
+SEARCH_TABLE = "user_user_search"
+# words of a search, the rest is ignored
+MAX_TERMS = 10
+# the shortest word found through the trigrams
+TRIGRAM_LENGTH = 3
+# weights of the name, department and introduce columns
+WEIGHTS = (10.0, 5.0, 1.0)
+
+
+def get_terms(text):
+    # quotes are no part of the indexed texts
+    return [term for term in re.split(r'[\s"]+', text or "") if term][:MAX_TERMS]
+
+
+def like_pattern(term):
+    return "%{}%".format(term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"))
+
+
+class FallbackBackend:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create(self):
+        """Create the index, return ``False`` if the database has none."""
+        return False
+
+    def drop(self):
+        pass
+
+    def index(self, queryset):
+        """Add or refresh the index rows of the users of ``queryset``."""
+
+    def remove(self, pks):
+        pass
+
+    def clear(self):
+        pass
+
+    def filter(self, terms):
+        q = Q()
+        for term in terms:
+            q &= Q(name__icontains=term) | Q(department__department__icontains=term) | Q(introduce__icontains=term)
+        return q
+
+    def rank(self, terms):
+        return Value(0.0, output_field=FloatField())
+
+    def documents(self, queryset):
+        """SQL selecting the users of ``queryset`` with the columns ``id, name, department, introduce``."""
+        qn = self.connection.ops.quote_name
+        sql, params = queryset.values("pk").query.sql_with_params()
+        return (
+            f"SELECT u.{qn('id')}, COALESCE(u.{qn('name')}, ''), COALESCE(d.{qn('department')}, ''), "
+            f"COALESCE(u.{qn('introduce')}, '') FROM {qn(User._meta.db_table)} u "
+            f"LEFT JOIN {qn(Department._meta.db_table)} d ON d.{qn('id')} = u.{qn('department_id')} "
+            f"WHERE u.{qn('id')} IN ({sql})",
+            params,
+        )
+
+    def execute(self, sql, params=()):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    @property
+    def user_id(self):
+        qn = self.connection.ops.quote_name
+        return f"{qn(User._meta.db_table)}.{qn('id')}"
+
+
+class TrigramBackend(FallbackBackend):
+    """The texts of the users are copied into ``SEARCH_TABLE``, whose index finds the words by their trigrams."""
+
+    columns = ("name", "department", "introduce")
+    # a column containing a word
+    like = "LIKE %s ESCAPE '\\'"
+
+    def drop(self):
+        self.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def like_score(self, terms):
+        """SQL of the weights of the columns containing each word, summed and negated, and its parameters."""
+        score = " + ".join(
+            f"{weight} * CAST(({column} {self.like}) AS integer)"
+            for column, weight in zip(self.columns, WEIGHTS)
+            for _term in terms
+        )
+        return f"-({score})", [like_pattern(term) for _column in self.columns for term in terms]
+
+
+class SQLiteBackend(TrigramBackend):
+    def create(self):
+        self.execute(f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(name, department, introduce, tokenize='trigram')")
+        return True
+
+    def index(self, queryset):
+        sql, params = queryset.values("pk").query.sql_with_params()
+        self.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({sql})", params)
+        sql, params = self.documents(queryset)
+        self.execute(f"INSERT INTO {SEARCH_TABLE} (rowid, name, department, introduce) {sql}", params)
+
+    def remove(self, pks):
+        pks = list(pks)
+        self.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(pks))})", pks)
+
+    def clear(self):
+        self.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    def where(self, terms):
+        """The condition on the index table and its parameters: ``MATCH`` of the long words, ``LIKE`` of the others."""
+        long_terms = [term for term in terms if len(term) >= TRIGRAM_LENGTH]
+        conditions, params = [], []
+        if long_terms:
+            conditions.append(f"{SEARCH_TABLE} MATCH %s")
+            params.append(" ".join('"{}"'.format(term) for term in long_terms))
+        for term in terms:
+            if len(term) < TRIGRAM_LENGTH:
+                conditions.append("({})".format(" OR ".join(f"{column} {self.like}" for column in self.columns)))
+                params += [like_pattern(term)] * len(self.columns)
+        return " AND ".join(conditions), params
+
+    def filter(self, terms):
+        where, params = self.where(terms)
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {where}", params))
+
+    def rank(self, terms):
+        where, params = self.where(terms)
+        if any(len(term) >= TRIGRAM_LENGTH for term in terms):
+            # bm25() is negative, the better the match the lower
+            score, score_params = f"bm25({SEARCH_TABLE}, {', '.join(str(weight) for weight in WEIGHTS)})", []
+        else:
+            score, score_params = self.like_score(terms)
+        return RawSQL(
+            f"SELECT {score} FROM {SEARCH_TABLE} WHERE {where} AND rowid = {self.user_id}",
+            [*score_params, *params],
+            output_field=FloatField(),
+        )
+
+
+class PostgreSQLBackend(TrigramBackend):
+    like = "ILIKE %s"
+    # the indexed text, the words of a search have no space so they can not match across two columns
+    document = "(name || ' ' || department || ' ' || introduce)"
+
+    def create(self):
+        qn = self.connection.ops.quote_name
+        self.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        self.execute(
+            f"CREATE TABLE {SEARCH_TABLE} (user_id bigint PRIMARY KEY "
+            f"REFERENCES {qn(User._meta.db_table)} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "name text NOT NULL, department text NOT NULL, introduce text NOT NULL)"
+        )
+        self.execute(f"CREATE INDEX {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING gin ({self.document} gin_trgm_ops)")
+        return True
+
+    def index(self, queryset):
+        sql, params = self.documents(queryset)
+        self.execute(
+            f"INSERT INTO {SEARCH_TABLE} (user_id, name, department, introduce) {sql} "
+            "ON CONFLICT (user_id) DO UPDATE SET "
+            "name = EXCLUDED.name, department = EXCLUDED.department, introduce = EXCLUDED.introduce",
+            params,
+        )
+
+    def remove(self, pks):
+        self.execute(f"DELETE FROM {SEARCH_TABLE} WHERE user_id = ANY(%s)", [list(pks)])
+
+    def clear(self):
+        self.execute(f"TRUNCATE {SEARCH_TABLE}")
+
+    def where(self, terms):
+        # the trigram index is only used for words of 3 characters or more
+        return " AND ".join([f"{self.document} {self.like}"] * len(terms)), [like_pattern(term) for term in terms]
+
+    def filter(self, terms):
+        where, params = self.where(terms)
+        return Q(pk__in=RawSQL(f"SELECT user_id FROM {SEARCH_TABLE} WHERE {where}", params))
+
+    def rank(self, terms):
+        score, params = self.like_score(terms)
+        return RawSQL(
+            f"SELECT {score} FROM {SEARCH_TABLE} WHERE user_id = {self.user_id}", params, output_field=FloatField()
+        )
+
+
+BACKENDS = {
+    "sqlite": SQLiteBackend,
+    "postgresql": PostgreSQLBackend,
+}
+
+
+def get_backend(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    return BACKENDS.get(connection.vendor, FallbackBackend)(connection)
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Receiver of ``post_migrate`` of all apps, creates the index and fills it if it does not exist yet.
+
+    The first app wins, so that the users added by the ``post_migrate`` of other apps
+    (e.g. the anonymous user of guardian) are indexed.
+    """
+    tables = connections[using].introspection.table_names()
+    if User._meta.db_table in tables and SEARCH_TABLE not in tables:
+        rebuild_search_index(using)
+
+
+def rebuild_search_index(using=DEFAULT_DB_ALIAS):
+    """Create the index again, so that it has the current layout, and fill it. Returns the number of users."""
+    backend = get_backend(using)
+    backend.drop()
+    if backend.create():
+        backend.index(User.objects.using(using).all())
+    return User.objects.using(using).count()
+
+
+def index_users(queryset):
+    get_backend(queryset.db).index(queryset)
+
+
+def unindex_users(pks, using=DEFAULT_DB_ALIAS):
+    if pks:
+        get_backend(using).remove(pks)
+
+
+def search_filter(text, using=DEFAULT_DB_ALIAS):
+    """``Q`` of the users matching all the words of ``text``, all the users when it has no word."""
+    terms = get_terms(text)
+    return get_backend(using).filter(terms) if terms else Q()
+
+
+def search_users(queryset, text):
+    """
+    The users of ``queryset`` matching ``text``, best matches first, with their
+    ``search_rank`` (the lower the better). The queryset is unchanged when ``text`` has no word.
+    """
+    terms = get_terms(text)
+    if not terms:
+        return queryset
+    backend = get_backend(queryset.db)
+    return (
+        queryset.filter(backend.filter(terms))
+        .annotate(search_rank=backend.rank(terms))
+        .order_by(F("search_rank").asc(nulls_last=True), "pk")
+    )
@@ -1,3 +1,42 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from apps.user.models import PkuIdSuffix
+from apps.user.search import index_users, unindex_users
+
+# fields of the users copied into the search index
+SEARCH_FIELDS = {"name", "department", "introduce"}
+
+
 def user_create_callback(sender, **kwargs):
     user = kwargs["user"]
     user.add_obj_perm("change_user", user)
+
+
+def user_search_post_save(sender, instance, update_fields=None, **kwargs):
+    # e.g. the last_login updates do not touch the index
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        index_users(sender._default_manager.using(instance._state.db).filter(pk=instance.pk))
+
+
+def user_search_post_delete(sender, instance, **kwargs):
+    unindex_users([instance.pk], using=instance._state.db)
+
+
+def department_search_post_save(sender, instance, created=False, **kwargs):
+    # the users of a renamed department
+    if not created:
+        index_users(instance.user_set.all())
+
+
+def user_pku_id_post_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "pku_id" not in update_fields:
+        return
+    pku_id = instance.__dict__.get("pku_id")
+    if pku_id != getattr(instance, "_loaded_pku_id", None):
+        PkuIdSuffix.objects.index([(instance.pk, pku_id)])
+        instance._loaded_pku_id = pku_id
+
+
+def create_pku_id_suffixes(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Receiver of ``post_migrate``, indexes the users created before the suffixes existed."""
+    PkuIdSuffix.objects.db_manager(using).index_missing()
@@ -1,9 +1,16 @@
+import base64
 import json
+import tempfile
 from io import StringIO
+from pathlib import Path
 from unittest import mock
 
+from django.core.cache import cache
 from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from graphene_django.utils.testing import GraphQLTestCase
 from graphql_jwt.settings import jwt_settings
 from graphql_jwt.shortcuts import get_token
@@ -11,8 +18,9 @@ from graphql_relay import to_global_id
 from guardian.shortcuts import assign_perm
 
 from apps.pku_auth.signals import user_create
-from apps.user.models import User, Department
+from apps.user.models import Department, PkuIdSuffix, User, pku_id_q
 from apps.user.schema import DepartmentType, UserType
+from apps.user.search import search_users
 
 
 class ModelTest(TestCase):
@@ -26,6 +34,117 @@ class ModelTest(TestCase):
         self.assertEqual(user.get_short_name(), "alice")
 
 
+class PkuIdSuffixTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = User.objects.create(pku_id="2000012345")
+        cls.user2 = User.objects.create(pku_id="1900123456")
+
+    def filter(self, lookup, value):
+        return list(User.objects.filter(pku_id_q("pku_id", lookup, value)).order_by("pku_id"))
+
+    def test_pku_id_q(self):
+        self.assertEqual(self.filter("contains", "123"), [self.user2, self.user1])
+        self.assertEqual(self.filter("contains", "456"), [self.user2])
+        self.assertEqual(self.filter("contains", "0001"), [self.user1])
+        self.assertEqual(self.filter("contains", "99"), [])
+        self.assertEqual(self.filter("startswith", "19"), [self.user2])
+        self.assertEqual(self.filter("startswith", "2000012345"), [self.user1])
+        self.assertEqual(self.filter("startswith", "3"), [])
+        self.assertEqual(self.filter("exact", "1900123456"), [self.user2])
+        self.assertEqual(len(self.filter("contains", "")), User.objects.count())
+
+    def test_suffixes_sync(self):
+        self.assertEqual(
+            sorted(self.user1.pku_id_suffixes.values_list("suffix", flat=True)),
+            sorted("2000012345"[i:] for i in range(10)),
+        )
+        user = User.objects.get(pk=self.user1.pk)
+        with self.assertNumQueries(1):
+            user.save(update_fields=["email"])
+        user.pku_id = "2100000000"
+        user.save()
+        self.assertEqual(self.filter("contains", "12345"), [self.user2])
+        self.assertEqual(self.filter("contains", "2100"), [user])
+
+        PkuIdSuffix.objects.all().delete()
+        self.assertEqual(self.filter("contains", "2100"), [])
+        call_command("rebuildusersearch", stdout=StringIO())
+        self.assertEqual(self.filter("contains", "2100"), [user])
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.physics = Department.objects.create(department="物理学院")
+        cls.zhang = User.objects.create(
+            pku_id="2000000000", name="张三", department=cls.physics, introduce="I like chemistry."
+        )
+        cls.li = User.objects.create(pku_id="2000000001", name="李四", introduce="Physics and chemistry, 张三 is a friend.")
+        cls.admin = User.objects.create(pku_id="2000000002", name="admin", is_admin=True, is_superuser=True)
+
+    def search(self, text):
+        return list(search_users(User.objects.all(), text))
+
+    def test_search_users(self):
+        self.assertEqual(self.search("张"), [self.zhang, self.li])
+        self.assertEqual(self.search("物理"), [self.zhang])
+        self.assertEqual(self.search("CHEM"), [self.zhang, self.li])
+        self.assertEqual(self.search("chem phys"), [self.li])
+        self.assertEqual(self.search('"张三'), [self.zhang, self.li])
+        self.assertEqual(self.search("王"), [])
+        self.assertEqual(len(self.search("  ")), User.objects.count())
+        self.assertLess(search_users(User.objects.all(), "张三").get(pk=self.zhang.pk).search_rank, 0)
+
+    def test_search_chinese(self):
+        # words are found anywhere in the texts, whatever their length
+        wang = User.objects.create(pku_id="2000000003", name="王小明", introduce="我研究凝聚态物理，也喜欢计算物理。")
+        self.assertEqual(self.search("三"), [self.zhang, self.li])
+        self.assertEqual(self.search("小明"), [wang])
+        self.assertEqual(self.search("物理"), [self.zhang, wang])
+        self.assertEqual(self.search("凝聚态"), [wang])
+        self.assertEqual(self.search("凝聚态物理 计算"), [wang])
+        self.assertEqual(self.search("三 物理"), [self.zhang])
+        self.assertEqual(self.search("100%"), [])
+        self.assertEqual(self.search("%"), [])
+
+    def test_search_index_sync(self):
+        self.li.introduce = ""
+        self.li.save()
+        self.assertEqual(self.search("张"), [self.zhang])
+        self.physics.department = "化学学院"
+        self.physics.save()
+        self.assertEqual(self.search("物理"), [])
+        self.assertEqual(self.search("化学"), [self.zhang])
+        self.zhang.delete()
+        self.assertEqual(self.search("张"), [])
+        with self.assertNumQueries(1):
+            self.li.save(update_fields=["last_login"])
+
+    def test_rebuild_search_index(self):
+        User.objects.filter(pk=self.li.pk).update(name="王五")
+        self.assertEqual(self.search("王"), [])
+        out = StringIO()
+        call_command("rebuildusersearch", stdout=out)
+        self.assertIn(f"{User.objects.count()} users indexed.", out.getvalue())
+        self.assertEqual(self.search("王"), [self.li])
+
+    def test_admin_search(self):
+        self.client.force_login(self.admin, backend="django.contrib.auth.backends.ModelBackend")
+        response = self.client.get(reverse("admin:user_user_changelist"), data={"q": "物理"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.zhang])
+        response = self.client.get(reverse("admin:user_user_changelist"), data={"q": "三"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.zhang, self.li])
+        response = self.client.get(reverse("admin:user_user_changelist"), data={"q": "2000000001"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.li])
+        # pku_id and email are matched anywhere
+        response = self.client.get(reverse("admin:user_user_changelist"), data={"q": "0000001"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.li])
+        User.objects.filter(pk=self.zhang.pk).update(email="zhangsan@pku.edu.cn")
+        response = self.client.get(reverse("admin:user_user_changelist"), data={"q": "SAN@PKU"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.zhang])
+
+
 class CommandTest(TestCase):
     @mock.patch("apps.pku_auth.management.commands.createclient.input")
     def _call_wrapper(self, response_value, mock_input=None):
@@ -40,6 +159,104 @@ class CommandTest(TestCase):
     def test_command(self):
         self.assertIn("OpenID client successfully created.", self._call_wrapper("http"))
 
+    def import_users(self, name, content, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / name
+            path.write_text(content, encoding="utf-8")
+            out, err = StringIO(), StringIO()
+            with CaptureQueriesContext(connection) as context:
+                call_command("importusers", str(path), stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue(), len(context.captured_queries)
+
+    def test_import_users(self):
+        physics = Department.objects.create(department="physics")
+        User.objects.create(pku_id="2000000000", name="old name", email="old@pku.edu.cn", department=physics)
+
+        def csv_content(start, count):
+            lines = ["pku_id,name,email,department"]
+            lines += [f"{start + i},student{i},s{i}@pku.edu.cn,{'physics' if i % 2 else 'math'}" for i in range(count)]
+            return "\n".join(lines) + "\n"
+
+        out, err, queries = self.import_users(
+            "users.csv", csv_content(2000000000, 4) + "123,invalid,,\n2000000003,last wins,,math\n"
+        )
+        self.assertIn("6 read, 3 created, 1 updated, 0 unchanged, 1 invalid", out)
+        self.assertIn("users/s", out)
+        self.assertIn("line 6: '123'", err)
+
+        user = User.objects.get(pku_id="2000000000")
+        self.assertEqual((user.name, user.email, user.department.department), ("student0", "s0@pku.edu.cn", "math"))
+        user = User.objects.get(pku_id="2000000003")
+        self.assertEqual(
+            (user.name, user.email, user.department), ("last wins", "", Department.objects.get(department="math"))
+        )
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(Department.objects.count(), 2)
+        # the permission given by user_create_callback
+        self.assertTrue(user.has_perm("change_user", user))
+        self.assertFalse(User.objects.get(pku_id="2000000000").has_perm("change_user", user))
+
+        # the number of queries depends on the batches, not on the users
+        _, _, few_queries = self.import_users("users.csv", csv_content(2100000000, 3), batch_size=100)
+        out, _, queries = self.import_users("users.csv", csv_content(2200000000, 30), batch_size=100)
+        self.assertEqual(queries, few_queries)
+        out, _, _ = self.import_users("users.csv", csv_content(2200000000, 30), batch_size=20)
+        self.assertIn("20 read, 0 created, 0 updated, 20 unchanged", out)
+        self.assertIn("30 read, 0 created, 0 updated, 30 unchanged", out)
+
+        out, _, _ = self.import_users(
+            "teachers.jsonl",
+            '{"pku_id": "1000000000", "name": "teacher", "department": "chemistry"}\n\n'
+            '{"pku_id": "2000000001", "is_teacher": false}\n',
+            teacher=True,
+            dry_run=True,
+        )
+        self.assertIn("2 read, 1 created, 0 updated, 1 unchanged", out)
+        self.assertFalse(User.objects.filter(pku_id="1000000000").exists())
+        self.import_users(
+            "teachers.jsonl",
+            '{"pku_id": "1000000000", "name": "teacher", "department": "chemistry"}\n',
+            teacher=True,
+        )
+        teacher = User.objects.get(pku_id="1000000000")
+        self.assertEqual((teacher.is_teacher, teacher.department.department), (True, "chemistry"))
+
+    def test_import_users_invalid_fields(self):
+        out, err, _ = self.import_users(
+            "users.jsonl",
+            "\n".join(
+                json.dumps(record)
+                for record in [
+                    {"pku_id": "2000000000", "name": "n" * 80},
+                    {"pku_id": "2000000001", "email": "not-an-email"},
+                    {"pku_id": "2000000002", "phone_number": "1" * 20},
+                    {"pku_id": "2000000003", "department": "d" * 101},
+                    {"pku_id": "2000000004", "name": "valid", "email": "", "department": "physics"},
+                ]
+            ),
+        )
+        self.assertIn("5 read, 1 created, 0 updated, 0 unchanged, 4 invalid", out)
+        self.assertIn(f"line 1: {'n' * 80!r} is not a valid name", err)
+        self.assertIn("line 2: 'not-an-email' is not a valid email", err)
+        self.assertIn(f"line 3: {'1' * 20!r} is not a valid phone_number", err)
+        self.assertIn(f"line 4: {'d' * 101!r} is not a valid department", err)
+        self.assertEqual(
+            list(User.objects.filter(pku_id__startswith="2").values_list("pku_id", flat=True)), ["2000000004"]
+        )
+        self.assertEqual(list(Department.objects.values_list("department", flat=True)), ["physics"])
+
+    def test_import_users_invalid_json(self):
+        out, err, _ = self.import_users(
+            "users.jsonl",
+            '{"pku_id": "2000000000"\n\n["2000000001"]\n"2000000002"\n{"pku_id": "2000000003", "name": "valid"}\n',
+        )
+        self.assertIn("4 read, 1 created, 0 updated, 0 unchanged, 3 invalid", out)
+        self.assertIn("line 1: invalid JSON", err)
+        # blank lines are counted in the line numbers
+        self.assertIn('line 3: ["2000000001"] is not an object', err)
+        self.assertIn('line 4: "2000000002" is not an object', err)
+        self.assertEqual(list(User.objects.filter(pku_id__startswith="2").values_list("name", flat=True)), ["valid"])
+
 
 class SignalTest(TestCase):
     @classmethod
@@ -223,6 +440,100 @@ class QueryApiTest(GraphQLTestCase):
             self.assertIsNotNone(node["userSet"])
             self.assertEqual(len(node["userSet"]["edges"]), 0)
 
+    def test_departments_query_count(self):
+        def query_count():
+            with CaptureQueriesContext(connection) as context:
+                response = self.query(
+                    """
+                    query{
+                      departments{
+                        edges{
+                          node{
+                            department
+                            userSet {
+                              edges {
+                                node {
+                                  name
+                                  pkuId
+                                  department {
+                                    department
+                                  }
+                                }
+                              }
+                            }
+                          }
+                        }
+                      }
+                    }
+                    """,
+                    headers=self.get_headers(user=self.t_admin),
+                )
+            self.assertResponseNoErrors(response)
+            content = json.loads(response.content)
+            for edge in content["data"]["departments"]["edges"]:
+                for user_edge in edge["node"]["userSet"]["edges"]:
+                    self.assertEqual(user_edge["node"]["department"]["department"], edge["node"]["department"])
+            self.assertNotIn("introduce", " ".join(query["sql"] for query in context.captured_queries[1:]))
+            return len(context.captured_queries)
+
+        count = query_count()
+        for i in range(3):
+            department = Department.objects.create(department=f"department{i}")
+            User.objects.create(pku_id=f"21000000{i}0", name=f"user{i}0", department=department)
+            User.objects.create(pku_id=f"21000000{i}1", name=f"user{i}1", department=department)
+        self.assertEqual(query_count(), count)
+
+    def test_departments_nested_page_limit(self):
+        department = Department.objects.create(department="crowded")
+        for i in range(50):
+            User.objects.create(pku_id=f"22000000{i:02}", name=f"user{i}", department=department)
+        with CaptureQueriesContext(connection) as context:
+            response = self.query(
+                """
+                query{
+                  departments(first: 1, department_Icontains: "crowded"){
+                    edges{ node{ userSet(first: 2){ pageInfo{ hasNextPage } edges{ node{ name } } } } }
+                  }
+                }
+                """,
+                headers=self.get_headers(user=self.t_admin),
+            )
+        self.assertResponseNoErrors(response)
+        user_set = json.loads(response.content)["data"]["departments"]["edges"][0]["node"]["userSet"]
+        self.assertEqual(len(user_set["edges"]), 2)
+        self.assertTrue(user_set["pageInfo"]["hasNextPage"])
+        user_queries = [query["sql"] for query in context.captured_queries if '"department_id" =' in query["sql"]]
+        self.assertEqual(len(user_queries), 1)
+        self.assertIn("LIMIT 3", user_queries[0])
+
+    def users_total_count(self, user, filters=""):
+        response = self.query(
+            """
+            query {
+              users%s {
+                totalCount
+              }
+            }
+            """
+            % filters,
+            headers=self.get_headers(user),
+        )
+        self.assertResponseNoErrors(response)
+        return json.loads(response.content)["data"]["users"]["totalCount"]
+
+    @mock.patch("apps.pku_auth.connection.table_estimate", return_value=1000)
+    def test_users_total_count_estimate(self, table_estimate):
+        cache.clear()
+        # only unfiltered lists of admins are estimated
+        self.assertEqual(self.users_total_count(self.s_admin), 1000)
+        self.assertEqual(self.users_total_count(self.s_admin, "(isTeacher: true)"), 2)
+        self.assertEqual(self.users_total_count(self.student), User.objects.count())
+        self.assertEqual(table_estimate.call_count, 1)
+
+        # without an estimate the count is exact
+        table_estimate.return_value = None
+        self.assertEqual(self.users_total_count(self.s_admin), User.objects.count())
+
     def test_departments(self):
         for user in self.users:
             response = self.query(
@@ -1125,6 +1436,63 @@ class QueryApiTest(GraphQLTestCase):
             func(user, "t", self.assertResponseNoErrors, 3)
             func(user, "a", self.assertResponseNoErrors, 3)
 
+    def test_users_with_search(self):
+        def func(user, text):
+            response = self.query(
+                """
+                query myQuery($text: String!){
+                  users (search: $text) {
+                    totalCount
+                    edges {
+                      node {
+                        name
+                      }
+                    }
+                  }
+                }
+                """,
+                variables={"text": text},
+                headers=self.get_headers(user),
+            )
+            self.assertResponseNoErrors(response)
+            content = json.loads(response.content)["data"]["users"]
+            self.assertEqual(content["totalCount"], len(content["edges"]))
+            return [edge["node"]["name"] for edge in content["edges"]]
+
+        for user in self.users:
+            self.assertEqual(func(user, "admin"), ["t_admin", "s_admin"])
+            self.assertEqual(func(user, "stud"), ["student", "s_admin"])
+            self.assertEqual(func(user, "teacher introduce"), ["teacher"])
+            self.assertEqual(func(user, "nobody"), [])
+
+    def test_users_keyset_cursors(self):
+        names, cursors, after = [], [], None
+        while True:
+            response = self.query(
+                """
+                query myQuery($after: String){
+                  users (keyset: true, first: 2, after: $after) {
+                    pageInfo { hasNextPage endCursor }
+                    edges { cursor node { name } }
+                  }
+                }
+                """,
+                variables={"after": after},
+                headers=self.get_headers(self.student),
+            )
+            self.assertResponseNoErrors(response)
+            page = json.loads(response.content)["data"]["users"]
+            names += [edge["node"]["name"] for edge in page["edges"]]
+            cursors += [edge["cursor"] for edge in page["edges"]]
+            if not page["pageInfo"]["hasNextPage"]:
+                break
+            after = page["pageInfo"]["endCursor"]
+        self.assertEqual(names, list(User.objects.order_by("pku_id").values_list("name", flat=True)))
+        # the cursors do not reveal the pku_id the student may not see
+        decoded = " ".join(base64.b64decode(cursor).decode() for cursor in cursors)
+        for pku_id in User.objects.values_list("pku_id", flat=True):
+            self.assertNotIn(pku_id, decoded)
+
     def test_users_with_filter_department_id_exact(self):
         def func(user, id, assert_func, count):
             response = self.query(
@@ -0,0 +1,11 @@
+import pytest
+from django.core.cache import cache
+
+from apps.meet_plan.models import clear_term_date_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # rolled back test data must not survive in the caches
+    cache.clear()
+    clear_term_date_cache()